@@ -1,6 +1,9 @@
 
 const serverURL = 'http://localhost:5500/';
-const urlRespEndPoint = serverURL + 'url'
+// one id per extension instance, so a dispatcher serving several
+// browsers can tell their leases apart
+const workerId = self.crypto.randomUUID()
+const urlRespEndPoint = serverURL + 'url?worker=' + workerId
 
 
 function postBackContent(message) {
@@ -1,5 +1,27 @@
 #! /bin/sh
+# chrome-looper.sh <scrape seconds> <pause seconds> [worker id]
+# with a worker id, every round runs its own chrome with the profile of
+# the worker, so each worker has its own extension instance, and the keys
+# are only sent to its own window. no incognito there, a new profile does
+# not allow the extension in it, and the profile keeps the workers apart
+if [ -z "$3" ]; then
+    while true
+    do
+        google-chrome --incognito --new-window https://ingatlan.com/ && sleep 5 && xdotool key Ctrl+Shift+L && sleep $1 && xdotool key Ctrl+W && sleep 1 && xdotool key Ctrl+W && sleep 1 && xdotool key Ctrl+W && sleep $2
+    done
+fi
+
+PROFILE="$HOME/.config/ingatlan-looper/$3"
+EXTENSION="$(cd "$(dirname "$0")" && pwd)/browser-extension"
+# xdotool keys go to the focused window, loopers take turns focusing theirs
+LOCK="/tmp/ingatlan-looper.lock"
 while true
 do
-    google-chrome --incognito --new-window https://ingatlan.com/ && sleep 5 && xdotool key Ctrl+Shift+L && sleep $1 && xdotool key Ctrl+W && sleep 1 && xdotool key Ctrl+W && sleep 1 && xdotool key Ctrl+W && sleep $2
+    google-chrome --user-data-dir="$PROFILE" --load-extension="$EXTENSION" --new-window https://ingatlan.com/ &
+    PID=$!
+    WID=$(xdotool search --sync --onlyvisible --pid $PID | head -n 1)
+    sleep 5 && flock "$LOCK" xdotool windowactivate --sync "$WID" key Ctrl+Shift+L && sleep $1
+    kill $PID
+    wait $PID
+    sleep $2
 done
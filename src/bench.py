@@ -0,0 +1,450 @@
+"""offline parser benchmarks on deterministic synthetic pages
+
+python -m src.bench [--sizes 50 200 800] [--out bench-results.jsonl]
+
+every stage and batch size runs in a fresh process, so peak RSS
+is measured per stage, results are appended as json lines
+"""
+
+import argparse
+import html
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from multiprocessing import get_context
+from types import SimpleNamespace
+from typing import Callable, Iterable, Union
+from unittest import mock
+
+import datazimmer as dz
+import pandas as pd
+
+from .meta import (
+    Contact,
+    Heating,
+    Label,
+    Location,
+    Parking,
+    Price,
+    RealEstate,
+    Seller,
+    UtilityCost,
+)
+
+DEFAULT_SIZES = [50, 200, 800]
+DEFAULT_OUT = "bench-results.jsonl"
+BASE_TS = 1_700_000_000
+
+_WORDS = ["lakás", "csendes", "világos", "felújított", "erkélyes", "tágas", "Budapest"]
+_DISTRICTS = ["XI. kerület", "XIII. kerület", "VI. kerület", "Debrecen", "Szeged"]
+
+
+@dataclass
+class FakePcev:
+    """quacks like aswan.ParsedCollectionEvent for the parsers"""
+
+    content: Union[bytes, str]
+    url: str
+    timestamp: int
+
+    @property
+    def cev(self):
+        return SimpleNamespace(timestamp=self.timestamp)
+
+
+def ad_payloads(i: int, rng: random.Random) -> tuple[dict, dict]:
+    prop = {}
+    for name, dtype in dz.EntityClass.from_cls(RealEstate).table_feature_dt_map.items():
+        if name in ["offer_type", "cluster_id"] or name.endswith("__id"):
+            continue
+        prop[_to_camel(name)] = _value(name, dtype, rng)
+    prop["sellerId"] = rng.randint(1, 300)
+    prop["locationId"] = rng.randint(1, 120)
+    interval = rng.choice([{"m": 1}, {"y": None, "m": 1, "d": None}, None])
+    listing = {
+        "id": i,
+        "type": rng.choice(["rent", "sale"]),
+        "clusterId": rng.randint(1, 10**6),
+        "minimumRentalPeriodMonth": rng.choice([None, 6, 12]),
+        "property": prop,
+        "prices": [
+            {
+                "amount": rng.randint(10**5, 10**6),
+                "currency": "HUF",
+                "interval": interval,
+            }
+        ]
+        + [
+            {"amount": rng.randint(200, 2000), "currency": "EUR", "interval": interval}
+            for _ in range(rng.randint(0, 1))
+        ],
+        "utilityCosts": rng.choice(
+            [None, {"amount": 25000, "currency": "HUF", "interval": {"m": 1}}]
+        ),
+        "contactPhoneNumbers": {
+            "numbers": [_phone(rng) for _ in range(rng.randint(0, 2))]
+        },
+        "heatingTypes": rng.sample(["gas", "district", "electric"], rng.randint(0, 2)),
+        "parking": rng.choice(
+            [
+                None,
+                {"type": "garage", "condition": "included", "price": None},
+                {
+                    "type": "street",
+                    "condition": "extra",
+                    "price": {"amount": 15000, "currency": "HUF", "interval": {"m": 1}},
+                },
+            ]
+        ),
+        "labels": rng.sample(
+            [{"name": "Új", "slug": "uj"}, {"name": "Exkluzív", "slug": "ex"}],
+            rng.randint(0, 2),
+        ),
+        "seller": {
+            "id": prop["sellerId"],
+            "name": f"Ingatlaniroda {prop['sellerId']} Kft.",
+            "websiteUrl": rng.choice([None, "https://example.hu"]),
+            "hideContactForm": rng.choice([True, False]),
+            "realtorsProhibited": rng.choice([True, False]),
+            "photoUrl": "https://example.hu/p.jpg",
+            "office": rng.choice([None, {"name": "Iroda"}]),
+        },
+    }
+    hierarchy = {
+        "locations": [
+            {
+                "id": lid,
+                "type": "city",
+                "name": f"Hely {lid}",
+                "namePostfix": "ban",
+                "slug": f"hely-{lid}",
+                "coordinates": "47.49,19.04",
+                "bounds": "47.4,19.0,47.6,19.1",
+                "urlPart": f"hely-{lid}",
+                "parentId": lid // 10 or None,
+                "isOfficeBuilding": False,
+                "usableInAd": True,
+                "polygon": ";".join(
+                    f"47.{j},19.{j}" for j in range(rng.randint(20, 200))
+                ),
+                "inflectionFrom": "ből",
+                "inflectionAt": "ban",
+                "zipCode": rng.choice([None, "1111"]),
+            }
+            for lid in sorted({1, prop["locationId"] // 10 + 1, prop["locationId"]})
+        ]
+    }
+    return listing, hierarchy
+
+
+def ad_page(i: int, rng: random.Random) -> bytes:
+    listing, hierarchy = ad_payloads(i, rng)
+    return _page(
+        '<div class="listing-main" id="listing" data-listing="{}" '
+        'data-location-hierarchy="{}"></div>'.format(
+            html.escape(json.dumps(listing, ensure_ascii=False)),
+            html.escape(json.dumps(hierarchy, ensure_ascii=False)),
+        )
+        + _filler(rng)
+    ).encode("utf-8")
+
+
+def old_listing_page(i: int, rng: random.Random) -> bytes:
+    cards = "".join(
+        f'<div class="listing js-listing" data-id="{i * 20 + j}">'
+        f'<div class="listing__photos-count">{rng.randint(0, 30)}</div>'
+        f'<div class="price">{_price_text(rng)}</div>'
+        f'<div class="listing__address">{rng.choice(_DISTRICTS)}</div>'
+        f'<div class="listing__data--area-size">{rng.randint(20, 150)} m²</div>'
+        f'<div class="listing__data--room-count">{rng.randint(1, 5)}</div>'
+        f'<div class="listing__data--balcony-size">{rng.randint(0, 9)} m²</div>'
+        "</div>"
+        for j in range(20)
+    )
+    return _page(cards + _filler(rng)).encode("utf-8")
+
+
+def new_listing_page(i: int, rng: random.Random) -> bytes:
+    cards = "".join(
+        f'<a class="listing-card" href="/{i * 20 + j}">'
+        f'<span class="text-onyx">{_price_text(rng)}</span>'
+        f'<span class="d-block">{rng.choice(_DISTRICTS)}</span>'
+        f"<span>photo_camera</span><span>{rng.randint(0, 30)}</span>"
+        f"<span>Alapterület</span><span>{rng.randint(20, 150)} m²</span>"
+        f"<span>Szobák</span><span>{rng.randint(1, 5)}</span>"
+        f"<span>Erkély</span><span>{rng.randint(0, 9)} m²</span>"
+        "</a>"
+        for j in range(20)
+    )
+    return _page(cards + _filler(rng)).encode("utf-8")
+
+
+def search_page(i: int, rng: random.Random) -> str:
+    cards = []
+    for j in range(20):
+        lid = i * 20 + j
+        value = {
+            "id": lid,
+            "rank": j,
+            "clusterId": rng.randint(1, 10**6),
+            "seller": {"websiteUrl": rng.choice(["", "https://example.hu"])},
+        }
+        atts = "".join(
+            '<div class="d-flex flex-column"><span>{}</span><span>{}</span></div>'.format(
+                k, v
+            )
+            for k, v in [
+                ("Alapterület", f"{rng.randint(20, 150)} m2"),
+                ("Szobák", str(rng.randint(1, 5))),
+                ("Erkély", f"{rng.randint(0, 9)} m2"),
+            ]
+        )
+        cards.append(
+            f'<a class="listing-card" href="/{lid}?x=1" data-listing-id="{lid}" '
+            'data-listings-page--results-listing-listing-value="'
+            f'{html.escape(json.dumps(value))}">'
+            '<div class="d-flex flex-column justify-content-between h-100">'
+            f'<span class="fw-bold">{rng.randint(100, 900)} 000 Ft/hó</span>'
+            '<span class="d-block fw-500 fs-7 text-onyx font-family-secondary">'
+            f"{rng.choice(_DISTRICTS)}</span>"
+            f'<div class="d-flex justify-content-start">{atts}</div>'
+            "</div></a>"
+        )
+    return _page("".join(cards) + _filler(rng))
+
+
+def detail_page(i: int, rng: random.Random) -> str:
+    if rng.random() < 0.1:
+        return _page('<img src="https://ingatlan.com/images/error-404.svg">')
+    number = rng.choice(["%number%", _phone(rng)])
+    return _page(
+        f'<span class="contact-phone-number">{number}</span>'
+        '<div id="hero-contact"><span class="text-onyx fs-6">Iroda</span>'
+        '<span class="d-block fs-7">Ügynök</span></div>'
+        f'<a href="/iroda/{i}">Összes hirdetés</a>' + _filler(rng)
+    )
+
+
+def _run_ad_extract(pcevs):
+    from .parse import extract_listing_payloads
+
+    return sum(
+        len(extract_listing_payloads(pcev.content)[1]["locations"]) + 1
+        for pcev in pcevs
+    )
+
+
+def _run_ad_decode(pcevs):
+    from .decode import decode_ad_batch
+    from .parse import extract_listing_payloads
+
+    dfs = decode_ad_batch(extract_listing_payloads(pcev.content) for pcev in pcevs)
+    return sum(df.shape[0] for df in dfs.values())
+
+
+def _run_ad_tables(pcevs):
+    from .parse import extract_listing_payloads
+
+    dfs = baseline_ad_tables(map(extract_listing_payloads, (p.content for p in pcevs)))
+    return sum(df.shape[0] for df in dfs.values())
+
+
+def _run_ad_tables_row_wise(pcevs):
+    from . import parse
+
+    with mock.patch.object(parse, "expand_dicts", parse.expand_rows):
+        return _run_ad_tables(pcevs)
+
+
+def _run_listing(pcevs):
+    from .parse import parse_listings
+
+    return parse_listings(pcevs).shape[0]
+
+
+def _run_search(pcevs):
+    from .ingatlan_webext import search_results_from_pcev
+
+    return sum(len(list(search_results_from_pcev(pcev))) for pcev in pcevs)
+
+
+def _run_detail(pcevs):
+    from .ingatlan_webext import detail_rec_from_pcev
+
+    return len(list(map(detail_rec_from_pcev, pcevs)))
+
+
+STAGES: dict[str, tuple[Callable, Callable, str]] = {
+    "ad_extract": (ad_page, _run_ad_extract, "https://ingatlan.com/{}"),
+    "ad_decode": (ad_page, _run_ad_decode, "https://ingatlan.com/{}"),
+    "ad_tables": (ad_page, _run_ad_tables, "https://ingatlan.com/{}"),
+    "ad_tables_row_wise": (ad_page, _run_ad_tables_row_wise, "https://ingatlan.com/{}"),
+    "listing_old": (
+        old_listing_page,
+        _run_listing,
+        "https://ingatlan.com/lista?page={}",
+    ),
+    "listing_new": (
+        new_listing_page,
+        _run_listing,
+        "https://ingatlan.com/lista?page={}",
+    ),
+    "webext_search": (
+        search_page,
+        _run_search,
+        "https://ingatlan.com/lista/kiado+lakas?page={}",
+    ),
+    "webext_detail": (detail_page, _run_detail, "https://ingatlan.com/{}"),
+}
+
+
+def baseline_ad_tables(
+    payloads: Iterable[tuple[dict, dict]],
+) -> dict[type, pd.DataFrame]:
+    """table frames of ad payloads by the per-table parsers of parse.py
+
+    the pipeline decode_ad_batch replaced, kept as its reference
+    """
+    from . import parse
+
+    child_parsers = {
+        "utility_costs": (UtilityCost, parse.parse_utility_cost),
+        "prices": (Price, parse.parse_price),
+        "contact_phone_numbers": (Contact, parse.parse_contact),
+        "heating_types": (Heating, parse.parse_heating),
+        "parking": (Parking, parse.parse_parking),
+        "labels": (Label, parse.parse_label),
+        "seller": (Seller, parse.parse_seller),
+    }
+    listings, hierarchies = zip(*payloads)
+    property_df = pd.DataFrame(listings).pipe(parse.parse_property)
+    out = {}
+    for col, (entity, parser) in child_parsers.items():
+        if property_df[col].astype(bool).any():
+            out[entity] = parser(property_df)
+    out[RealEstate] = property_df
+    out[Location] = pd.DataFrame(hierarchies).pipe(parse.parse_location)
+    return out
+
+
+# stages compared to each other run on the same pages
+SAME_PAGES = {"ad_tables_row_wise": "ad_tables"}
+
+
+def get_pcevs(stage: str, n: int, seed: int = 42) -> list[FakePcev]:
+    generator, _, url_template = STAGES[stage]
+    rng = random.Random(f"{SAME_PAGES.get(stage, stage)}-{seed}")
+    return [
+        FakePcev(generator(i, rng), url_template.format(i + 1), BASE_TS + i * 60)
+        for i in range(n)
+    ]
+
+
+def run_stage(stage: str, batch_size: int, seed: int = 42) -> dict:
+    os.environ.setdefault("WEBEXT_EXPORT_ROOT", tempfile.mkdtemp())
+    pcevs = get_pcevs(stage, batch_size, seed)
+    start = time.perf_counter()
+    n_recs = STAGES[stage][1](pcevs)
+    elapsed = time.perf_counter() - start
+    return {
+        "stage": stage,
+        "batch_size": batch_size,
+        "pages": len(pcevs),
+        "records": n_recs,
+        "seconds": round(elapsed, 4),
+        "pages_per_sec": round(len(pcevs) / elapsed, 2),
+        "records_per_sec": round(n_recs / elapsed, 2),
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+    }
+
+
+def run_benchmarks(stages=None, sizes=DEFAULT_SIZES, seed=42, out=DEFAULT_OUT):
+    meta = {"commit": _git_rev(), "run_at": int(time.time()), "seed": seed}
+    results = []
+    ctx = get_context("spawn")
+    for stage in stages or STAGES:
+        for size in sizes:
+            with ProcessPoolExecutor(1, mp_context=ctx) as executor:
+                res = meta | executor.submit(run_stage, stage, size, seed).result()
+            print(json.dumps(res))
+            results.append(res)
+    if out:
+        with open(out, "a") as fp:
+            fp.writelines(json.dumps(res) + "\n" for res in results)
+    return results
+
+
+def _page(body: str) -> str:
+    return (
+        '<!DOCTYPE html><html lang="hu"><head><meta charset="utf-8">'
+        "<title>ingatlan.com</title></head><body>"
+        f"{body}</body></html>"
+    )
+
+
+def _filler(rng: random.Random, n: int = 120) -> str:
+    return "".join(
+        f'<div class="d-none filler-{k}"><p>{" ".join(rng.choices(_WORDS, k=12))}'
+        "</p></div>"
+        for k in range(n)
+    )
+
+
+def _value(name: str, dtype: type, rng: random.Random):
+    if rng.random() < 0.2:
+        return None
+    if name.startswith(("is_", "has_")) or name == "participated_in_the_panel_program":
+        return rng.choice([True, False])
+    if dtype is float:
+        return round(rng.uniform(1, 200), 1)
+    if name == "description":
+        return " ".join(rng.choices(_WORDS, k=rng.randint(20, 400)))
+    if name == "available_from":
+        return f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+    if name == "updated_at":
+        return f"2024-01-{rng.randint(1, 28):02d}T10:00:00+01:00"
+    return rng.choice(["a", "b", "c", "d"]) + name[:3]
+
+
+def _phone(rng: random.Random) -> str:
+    return f"+36 {rng.choice([20, 30, 70])} {rng.randint(100, 999)} {rng.randint(1000, 9999)}"
+
+
+def _price_text(rng: random.Random) -> str:
+    return f"{rng.randint(100, 900)} ezer Ft/hó"
+
+
+def _to_camel(name: str) -> str:
+    first, *rest = name.split("_")
+    return first + "".join(w.title() for w in rest)
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def _git_rev() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--stages", nargs="*", choices=[*STAGES], default=None)
+    parser.add_argument("--sizes", nargs="*", type=int, default=DEFAULT_SIZES)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", default=DEFAULT_OUT)
+    args = parser.parse_args()
+    run_benchmarks(args.stages, args.sizes, args.seed, args.out)
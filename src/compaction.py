@@ -0,0 +1,281 @@
+import argparse
+import fcntl
+import os
+import re
+import tempfile
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from itertools import chain
+from pathlib import Path
+from typing import Iterable
+
+import datazimmer as dz
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from atqo import acquire_lock
+from datazimmer.config_loading import RunConfig
+from structlog import get_logger
+
+from .reader import ROW_GROUP_SIZE
+
+logger = get_logger(ctx="compaction")
+
+# files of one partition in a TableRepo with max_records set
+PART_FILE = re.compile(r"file-(\d{20})\.parquet")
+MAX_FILE_ROWS = 2_000_000
+TMP_SUFFIX = ".compacting"
+# the schema file of a TableRepo that is not a single file
+META_FILE = "empty.meta"
+COLLECT_LOCK_PATH = Path(
+    os.environ.get(
+        "INGATLAN_COLLECT_LOCK", Path(tempfile.gettempdir(), "ingatlan-collect.lock")
+    )
+)
+
+
+class MissingColumns(Exception):
+    "Columns of the entity missing from the files of its table"
+
+
+class CollectRunning(Exception):
+    "A collect is writing the tables"
+
+
+@contextmanager
+def collect_lock(exclusive: bool = False):
+    """shared by the collects, compaction run on its own takes it exclusively
+
+    and refuses to run instead of waiting if a collect holds it,
+    a collect started during such a compaction waits for it
+    """
+    COLLECT_LOCK_PATH.parent.mkdir(exist_ok=True, parents=True)
+    with open(COLLECT_LOCK_PATH, "a") as fp:
+        try:
+            fcntl.flock(
+                fp, (fcntl.LOCK_EX | fcntl.LOCK_NB) if exclusive else fcntl.LOCK_SH
+            )
+        except BlockingIOError:
+            raise CollectRunning(f"{COLLECT_LOCK_PATH} is held by a collect")
+        yield
+
+
+def compact_paths(
+    paths: Iterable[Path],
+    by: list[str],
+    name: str = "",
+    max_file_rows: int = MAX_FILE_ROWS,
+    row_group_size: int = ROW_GROUP_SIZE,
+) -> Counter:
+    """rewrites each partition of a table into few sorted files
+
+    the file-<n>.parquet files of a directory make up a partition, any
+    other parquet file is a partition of its own. new files are written
+    next to the old ones under a temporary name and moved in place with
+    os.replace, so a reader sees either an old or a new file, never a
+    partial one. pyarrow reads the footer and the data of a file
+    separately, a swap in between fails the read, read_filtered retries
+    these. partitions that are already compact are not rewritten
+
+    merging the files of a multi-file partition is not atomic as a
+    whole: a reader listing the partition during the moves can see rows
+    twice or find a file gone. the tables of this repo are not set up
+    with max_records, so all their partitions are single files
+
+    the files are locked the same way parquetranger locks them for
+    writing, that covers the writers of the process, collect_lock the
+    ones of other processes
+    """
+    counter = Counter()
+    for partition in _get_partitions(paths):
+        counter.update(compact_partition(partition, by, max_file_rows, row_group_size))
+    logger.info(
+        "compacted",
+        table=name,
+        bytes_saved=counter["bytes_before"] - counter["bytes_after"],
+        **counter,
+    )
+    return counter
+
+
+def compact_partition(
+    paths: list[Path],
+    by: list[str],
+    max_file_rows: int = MAX_FILE_ROWS,
+    row_group_size: int = ROW_GROUP_SIZE,
+) -> Counter:
+    locks = [acquire_lock(p) for p in sorted(paths)]
+    try:
+        return _compact_locked(paths, by, max_file_rows, row_group_size)
+    finally:
+        for lock in locks:
+            lock.release()
+
+
+def _compact_locked(
+    paths: list[Path], by: list[str], max_file_rows: int, row_group_size: int
+) -> Counter:
+    bytes_before = sum(p.stat().st_size for p in paths)
+    counter = Counter(partitions=1, files_before=len(paths), bytes_before=bytes_before)
+    table = pa.concat_tables(map(pq.read_table, paths), promote_options="default")
+    sort_keys = [(c, "ascending") for c in by if c in table.column_names]
+    order = pc.sort_indices(table, sort_keys=sort_keys)
+    if PART_FILE.fullmatch(paths[0].name):
+        n_files = min(int(np.ceil(table.num_rows / max_file_rows)) or 1, len(paths))
+        out_paths = [paths[0].parent / f"file-{i:020d}.parquet" for i in range(n_files)]
+    else:
+        n_files, out_paths = 1, paths
+    if (len(paths) == n_files) and _is_compact(paths, order, row_group_size):
+        return counter + Counter(files_after=n_files, bytes_after=bytes_before)
+    table = table.take(order)
+    file_rows = int(np.ceil(table.num_rows / n_files))
+    tmp_paths = [p.with_name(p.name + TMP_SUFFIX) for p in out_paths]
+    try:
+        # with the codec parquetranger writes, so a partition stays
+        # compact until its next write
+        for i, tmp_path in enumerate(tmp_paths):
+            pq.write_table(
+                table.slice(i * file_rows, file_rows),
+                tmp_path,
+                row_group_size=row_group_size,
+            )
+        for tmp_path, out_path in zip(tmp_paths, out_paths):
+            os.replace(tmp_path, out_path)
+    finally:
+        for tmp_path in tmp_paths:
+            tmp_path.unlink(missing_ok=True)
+    for path in set(paths) - set(out_paths):
+        path.unlink()
+    return counter + Counter(
+        rewritten=1,
+        rows=table.num_rows,
+        files_after=len(out_paths),
+        bytes_after=sum(p.stat().st_size for p in out_paths),
+    )
+
+
+def compact_webext_exports(**kwargs) -> Counter:
+    from .ingatlan_webext import detail_trepo, search_trepo
+
+    counter = Counter()
+    for trepo in [search_trepo, detail_trepo]:
+        counter += compact_paths(trepo.paths, ["id", "collected"], trepo.name, **kwargs)
+    return counter
+
+
+def compact_tables(**kwargs) -> Counter:
+    from .ingatlan import READ_SORTING
+
+    counter = Counter()
+    for table, by in READ_SORTING.items():
+        counter += compact_paths(get_write_paths(table), by, table.name, **kwargs)
+    return counter
+
+
+def get_write_paths(table: "dz.ScruTable", with_meta: bool = False) -> list[Path]:
+    """the files of a table in the env the writes go to"""
+    with table.env_ctx(RunConfig.load().write_env):
+        paths = list(table.trepo.paths)
+        meta_path = Path(table.trepo.main_path, META_FILE)
+    if with_meta and meta_path.exists():
+        paths.append(meta_path)
+    return paths
+
+
+def get_entity_schema(dtype_map: dict) -> pa.Schema:
+    """the arrow types of the columns as a parsed frame of the entity has them"""
+    empty = pd.DataFrame({c: pd.Series(dtype=t) for c, t in dtype_map.items()})
+    return pa.Schema.from_pandas(empty, preserve_index=False)
+
+
+def get_missing_columns(paths: Iterable[Path], schema: pa.Schema) -> dict:
+    """path -> the fields of the schema missing from the file"""
+    out = {}
+    for path in paths:
+        names = pq.read_schema(path).names
+        missing = [f for f in schema if f.name not in names]
+        if missing:
+            out[path] = missing
+    return out
+
+
+def add_missing_columns(paths: Iterable[Path], schema: pa.Schema) -> Counter:
+    """adds the fields of the schema missing from the files as nulls
+
+    parquetranger casts every write to the schema of the files already
+    there, so a column added to an entity would be dropped from all
+    writes to an existing table until its files have it
+    """
+    counter = Counter()
+    for path, missing in get_missing_columns(paths, schema).items():
+        lock = acquire_lock(path)
+        try:
+            table = pq.read_table(path)
+            for field in missing:
+                table = table.append_column(field, pa.nulls(table.num_rows, field.type))
+            _replace_file(table, path)
+        finally:
+            lock.release()
+        counter["files_migrated"] += 1
+        counter["columns_added"] += len(missing)
+        logger.info("added columns", path=path, cols=[f.name for f in missing])
+    return counter
+
+
+def migrate_table(table: "dz.ScruTable") -> Counter:
+    schema = get_entity_schema(table.dtype_map)
+    return add_missing_columns(get_write_paths(table, with_meta=True), schema)
+
+
+def check_columns(table: "dz.ScruTable"):
+    schema = get_entity_schema(table.dtype_map)
+    missing = get_missing_columns(get_write_paths(table), schema)
+    if missing:
+        cols = sorted({f.name for fields in missing.values() for f in fields})
+        raise MissingColumns(f"{table.name} files are missing {cols}")
+
+
+def _replace_file(table: pa.Table, path: Path, **write_kwargs):
+    tmp_path = path.with_name(path.name + TMP_SUFFIX)
+    try:
+        pq.write_table(table, tmp_path, **write_kwargs)
+        os.replace(tmp_path, path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+def _get_partitions(paths: Iterable[Path]) -> list[list[Path]]:
+    dirs = defaultdict(list)
+    singles = []
+    for path in map(Path, paths):
+        if PART_FILE.fullmatch(path.name):
+            dirs[path.parent].append(path)
+        else:
+            singles.append([path])
+    return [*singles, *map(sorted, dirs.values())]
+
+
+def _is_compact(paths: list[Path], order: pa.Array, row_group_size: int) -> bool:
+    metas = [pq.ParquetFile(p).metadata for p in paths]
+    groups = [m.row_group(i) for m in metas for i in range(m.num_row_groups)]
+    return bool((order.to_numpy() == np.arange(len(order))).all()) and (
+        max(chain((g.num_rows for g in groups), [0])) <= row_group_size
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tables", action="store_true", help="the dz tables too")
+    parser.add_argument("--max-file-rows", type=int, default=MAX_FILE_ROWS)
+    args = parser.parse_args()
+    with collect_lock(exclusive=True):
+        counter = compact_webext_exports(max_file_rows=args.max_file_rows)
+        if args.tables:
+            counter += compact_tables(max_file_rows=args.max_file_rows)
+    logger.info(
+        "compaction done",
+        bytes_saved=counter["bytes_before"] - counter["bytes_after"],
+        **counter,
+    )
@@ -0,0 +1,267 @@
+from typing import Iterable, Iterator, Optional
+
+import datazimmer as dz
+import pandas as pd
+
+from .drift import drift_rec
+from .meta import (
+    Contact,
+    Heating,
+    Label,
+    Location,
+    Parking,
+    Price,
+    RealEstate,
+    Seller,
+    UtilityCost,
+)
+from .parse import _camel_to_snake, parse_location
+
+_MISSING = float("nan")
+
+
+class ColumnBuffer:
+    """appends records straight into per-column lists
+
+    keys missing from a record are padded with NaN,
+    the same way a DataFrame built from a list of dicts would be
+    """
+
+    def __init__(self, index_cols: Optional[list] = None):
+        self.index_cols = index_cols or []
+        self.cols: dict[str, list] = {}
+        self.n = 0
+
+    def append(self, rec: dict):
+        for k, v in rec.items():
+            col = self.cols.get(k)
+            if col is None:
+                col = self.cols[k] = [_MISSING] * self.n
+            col.append(v)
+        self.n += 1
+        for col in self.cols.values():
+            if len(col) < self.n:
+                col.append(_MISSING)
+
+    def to_df(self) -> pd.DataFrame:
+        df = pd.DataFrame(self.cols)
+        return df.set_index(self.index_cols) if self.index_cols else df
+
+
+class ListingDecoder:
+    """walks each data-listing dict once, filling one buffer per table
+
+    a child field in a shape its records can not be made of is added
+    to drift with the property id, instead of failing the batch
+    """
+
+    def __init__(self, skip_dims: Iterable[str] = (), drift: Optional[list] = None):
+        self._seen_ids = set()
+        self._buffers = {
+            RealEstate: ColumnBuffer([RealEstate.id]),
+            **{entity: ColumnBuffer(cols) for entity, (cols, _) in CHILDREN.items()},
+        }
+        self._sellers = set()
+        self._skip_dims = set(skip_dims)
+        self.drift = [] if drift is None else drift
+
+    def add(self, listing: dict):
+        pid = listing[RealEstate.id]
+        if pid in self._seen_ids:
+            return
+        self._seen_ids.add(pid)
+        rec = {}
+        children = {}
+        for k, v in listing.items():
+            if k == "property":
+                rec.update({_snake(pk): pv for pk, pv in v.items()})
+                continue
+            if k == "minimumRentalPeriodMonth":
+                continue
+            sk = "offer_type" if k == "type" else _snake(k)
+            if sk in CHILD_COLS:
+                children[sk] = v
+            else:
+                rec[sk] = v
+        child_recs = []
+        for sk, v in children.items():
+            entity = CHILD_COLS[sk]
+            try:
+                # all or none of the records of a field, never a part
+                recs = list(CHILDREN[entity][1](pid, v))
+            except (AttributeError, KeyError, TypeError, ValueError):
+                self.drift.append(drift_rec(entity.__name__, sk, pid, v))
+                continue
+            child_recs.extend((entity, r) for r in recs)
+        self._buffers[RealEstate].append(_rename_ids(rec))
+        for entity, child_rec in child_recs:
+            if entity is Seller:
+                if (child_rec[Seller.id] in self._sellers) or (
+                    get_dim_key(Seller, child_rec) in self._skip_dims
+                ):
+                    continue
+                self._sellers.add(child_rec[Seller.id])
+            self._buffers[entity].append(child_rec)
+
+    def extend(self, listings: Iterable[dict]):
+        for listing in listings:
+            self.add(listing)
+        return self
+
+    def get_dfs(self) -> dict[type, pd.DataFrame]:
+        """non-empty tables, children reindexed to their feature columns"""
+        out = {}
+        for entity, buffer in self._buffers.items():
+            if buffer.n == 0:
+                continue
+            df = buffer.to_df()
+            if entity is RealEstate:
+                df[RealEstate.available_from] = pd.to_datetime(
+                    df[RealEstate.available_from], errors="coerce"
+                )
+            else:
+                df = df.reindex(_feature_cols(entity), axis=1)
+            out[entity] = df
+        return out
+
+
+def decode_ad_batch(
+    payloads: Iterable[tuple[dict, dict]],
+    skip_dims: Iterable[str] = (),
+    drift: Optional[list] = None,
+) -> dict[type, pd.DataFrame]:
+    """all table frames of (data-listing, data-location-hierarchy) pairs
+
+    locations and sellers with a key from get_dim_key in skip_dims are
+    left out, as they are already stored unchanged
+    """
+    skip_dims = set(skip_dims)
+    decoder = ListingDecoder(skip_dims, drift)
+    locations = []
+    for listing, hierarchy in payloads:
+        decoder.add(listing)
+        locations.extend(
+            loc
+            for loc in hierarchy.get("locations") or []
+            if get_dim_key(Location, loc) not in skip_dims
+        )
+    dfs = decoder.get_dfs()
+    if locations:
+        dfs[Location] = pd.DataFrame({"locations": [locations]}).pipe(parse_location)
+    return dfs
+
+
+def iter_dim_recs(payloads: Iterable[tuple[dict, dict]]) -> Iterator[tuple[str, dict]]:
+    """(key, raw record) of every location and seller in the payloads"""
+    for listing, hierarchy in payloads:
+        for loc in hierarchy.get("locations") or []:
+            yield get_dim_key(Location, loc), loc
+        if isinstance(seller := listing.get("seller"), dict):
+            yield get_dim_key(Seller, seller), seller
+
+
+def get_dim_key(entity: type, rec) -> str:
+    rec_id = rec.get("id") if isinstance(rec, dict) else None
+    return f"{entity.__name__}:{rec_id}"
+
+
+def _snake(k: str) -> str:
+    try:
+        return _SNAKE_CACHE[k]
+    except KeyError:
+        return _SNAKE_CACHE.setdefault(k, _camel_to_snake(k))
+
+
+def _rename_ids(rec: dict) -> dict:
+    for k, new_k in [
+        ("seller_id", RealEstate.seller_id.id),
+        ("location_id", RealEstate.location_id.id),
+    ]:
+        if k in rec:
+            rec[new_k] = rec.pop(k)
+    return rec
+
+
+def _feature_cols(entity) -> list[str]:
+    return dz.EntityClass.from_cls(entity).table_feature_cols
+
+
+def _flat_interval(dic: dict) -> dict:
+    out = {k: v for k, v in dic.items() if k != "interval"}
+    for k, v in (dic.get("interval") or {}).items():
+        out[f"interval_{k}"] = v
+    return out
+
+
+def _price_recs(pid, prices):
+    for price in prices or []:
+        if isinstance(price, dict):
+            yield {Price.property_id.id: pid, **_flat_interval(price)}
+
+
+def _utility_cost_recs(pid, cost):
+    if isinstance(cost, dict):
+        yield {UtilityCost.property_id.id: pid, **_flat_interval(cost)}
+
+
+def _contact_recs(pid, contact):
+    for number in (contact or {}).get("numbers") or []:
+        if number is not None:
+            yield {Contact.property_id.id: pid, Contact.phone_number: number}
+
+
+def _heating_recs(pid, heating_types):
+    for heating_type in heating_types or []:
+        if heating_type is not None:
+            yield {Heating.property_id.id: pid, Heating.heating_type: heating_type}
+
+
+def _parking_recs(pid, parking):
+    if isinstance(parking, dict):
+        rec = {k: v for k, v in parking.items() if k != "price"}
+        yield {
+            Parking.property_id.id: pid,
+            **rec,
+            **_flat_interval(parking.get("price") or {}),
+        }
+
+
+def _label_recs(pid, labels):
+    for label in labels or []:
+        if isinstance(label, dict):
+            yield {Label.property_id.id: pid, Label.label: label.get("name")}
+
+
+def _seller_recs(_, seller):
+    if isinstance(seller, dict):
+        rec = {
+            _snake(k): v
+            for k, v in seller.items()
+            if k not in ["photoUrl", "projectLogoUrl", "office"]
+        }
+        office = seller.get("office")
+        rec[Seller.agency] = office["name"] if isinstance(office, dict) else None
+        yield rec
+
+
+CHILDREN = {
+    UtilityCost: ([UtilityCost.property_id.id], _utility_cost_recs),
+    Price: ([Price.property_id.id, Price.currency], _price_recs),
+    Contact: ([Contact.property_id.id, Contact.phone_number], _contact_recs),
+    Heating: ([Heating.property_id.id, Heating.heating_type], _heating_recs),
+    Parking: ([Parking.property_id.id], _parking_recs),
+    Label: ([Label.property_id.id, Label.label], _label_recs),
+    Seller: ([Seller.id], _seller_recs),
+}
+
+CHILD_COLS = {
+    "utility_costs": UtilityCost,
+    "prices": Price,
+    "contact_phone_numbers": Contact,
+    "heating_types": Heating,
+    "parking": Parking,
+    "labels": Label,
+    "seller": Seller,
+}
+
+_SNAKE_CACHE = {}
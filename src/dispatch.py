@@ -0,0 +1,335 @@
+import json
+import queue
+import random
+import subprocess
+import threading
+import time
+from collections import Counter, deque
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+import aswan
+import requests
+from aswan.connection_session import DEFAULT_EXCEPTION_STATUS, EXCEPTION_STATUSES
+from aswan.constants import (
+    WE_COMMAND_K,
+    WE_SOURCE_K,
+    WE_URL_K,
+    WE_URL_ROUTE,
+    WEBEXT_PORT,
+    Statuses,
+)
+from aswan.models import CollEvent, RegEvent
+from flask import Flask, make_response, request
+from flask_cors import CORS
+from structlog import get_logger
+from werkzeug.serving import make_server
+
+from .metrics import timed
+
+logger = get_logger(ctx="dispatch")
+
+# served when nothing can be leased, same as the aswan webext app
+IDLE_URL = "https://myexternalip.com/json"
+
+
+@dataclass
+class Lease:
+    url: str
+    handler: str
+    attempt: int = 0
+    worker: str = ""
+    deadline: float = 0
+
+
+class UrlDispatcher:
+    """leases the urls of the current aswan run to concurrent webext workers
+
+    speaks the protocol of the browser extension: a worker asks for a url
+    on /url (optionally with ?worker=<id>) and posts the page source back,
+    a lease not answered within lease_timeout is given to the next worker
+    asking, received pages are parsed in the dispatching thread and
+    written to the depot in batches
+    """
+
+    def __init__(
+        self,
+        project: aswan.Project,
+        handlers: Iterable[type],
+        lease_timeout: float = 120,
+        max_attempts: int = 3,
+        write_every: int = 50,
+        write_seconds: float = 15,
+        queue_size: int = 100,
+        port: int = WEBEXT_PORT,
+    ):
+        self.project = project
+        self.handlers = {h.__name__: h() for h in handlers}
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        self.write_every = write_every
+        self.write_seconds = write_seconds
+        self.queue_size = queue_size
+        self.port = port
+        self.counter = Counter()
+        self._todo: deque[Lease] = deque()
+        self._leases: dict[str, Lease] = {}
+        self._results = queue.Queue()
+        self._events = []
+        self._lock = threading.Lock()
+        self._last_write = time.monotonic()
+
+    def run(
+        self,
+        urls_to_register: Optional[dict] = None,
+        urls_to_overwrite: Optional[dict] = None,
+        new_run: bool = False,
+    ):
+        depot = self.project.depot
+        if new_run:
+            depot.setup()
+            depot.set_as_current(depot.get_complete_status())
+        else:
+            depot.current.setup()
+            depot.current.reset_surls([Statuses.PROCESSING])
+        depot.current.integrate_events(
+            [
+                *_get_reg_events(urls_to_register, False),
+                *_get_reg_events(urls_to_overwrite, True),
+            ]
+        )
+        server = make_server("0.0.0.0", self.port, self.get_app(), threaded=True)
+        server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+        server_thread.start()
+        try:
+            while self._step():
+                time.sleep(0.1)
+        finally:
+            self._write()
+            server.shutdown()
+            server_thread.join()
+        logger.info("dispatching done", **self.counter)
+
+    def lease(self, worker: str) -> Optional[str]:
+        with self._lock:
+            if not self._todo:
+                return None
+            lease = self._todo.popleft()
+            lease.worker = worker
+            lease.deadline = time.monotonic() + self.lease_timeout
+            self._leases[lease.url] = lease
+            self.counter["leased"] += 1
+            return lease.url
+
+    def submit(self, url: str, blob: bytes):
+        with self._lock:
+            lease = self._leases.pop(url, None)
+            if lease is None:
+                self.counter["unknown_results"] += 1
+                return
+            self._results.put((lease, blob))
+
+    def get_app(self) -> Flask:
+        app = Flask(__name__)
+        CORS(app)
+
+        @app.route("/", methods=["POST", "GET"])
+        def post():
+            data = json.loads(request.data)
+            if command := data.get(WE_COMMAND_K):
+                logger.info("running command", command=command)
+                try:
+                    subprocess.call(command)
+                except Exception as e:
+                    logger.error("command failed", command=command, e=str(e))
+                return make_response(f"tried running command {command}")
+            self.submit(data[WE_URL_K], request.data)
+            return make_response("Page source received")
+
+        @app.route(f"/{WE_URL_ROUTE}")
+        def url():
+            worker = request.args.get("worker", request.remote_addr)
+            return make_response(self.lease(worker) or IDLE_URL)
+
+        return app
+
+    def _step(self) -> bool:
+        # returns whether there is anything left to dispatch
+        self._refill()
+        while True:
+            try:
+                lease, blob = self._results.get_nowait()
+            except queue.Empty:
+                break
+            self._proc_result(lease, blob)
+        if (len(self._events) >= self.write_every) or (
+            time.monotonic() - self._last_write > self.write_seconds
+        ):
+            self._write()
+        with self._lock:
+            self._expire()
+            busy = self._todo or self._leases
+        if busy or not self._results.empty():
+            return True
+        self._write()
+        self._refill()
+        return bool(self._todo)
+
+    def _refill(self):
+        with self._lock:
+            n_missing = self.queue_size - len(self._todo)
+        if n_missing <= 0:
+            return
+        leases = self.project.depot.current.next_batch(n_missing, parser=_to_leases)
+        with self._lock:
+            for lease in leases:
+                if lease.handler not in self.handlers:
+                    logger.warning("no handler to dispatch", handler=lease.handler)
+                    continue
+                self._todo.append(lease)
+
+    def _expire(self):
+        # only called from the dispatching thread, as it can add events
+        now = time.monotonic()
+        for url, lease in list(self._leases.items()):
+            if lease.deadline > now:
+                continue
+            del self._leases[url]
+            self.counter["expired"] += 1
+            self._retry(lease, TimeoutError(f"lease of {lease.worker} expired"))
+
+    def _retry(self, lease: Lease, e: Exception):
+        lease.attempt += 1
+        if lease.attempt < self.max_attempts:
+            self._todo.appendleft(lease)
+            return
+        self.counter["gave_up"] += 1
+        out = {"e_type": type(e).__name__, "e_msg": str(e).split("\n")[0]}
+        status = EXCEPTION_STATUSES.get(type(e), Statuses.CONNECTION_ERROR)
+        self._add_event(lease, out, status)
+
+    def _proc_result(self, lease: Lease, blob: bytes):
+        handler = self.handlers[lease.handler]
+        handler.set_url(lease.url)
+        try:
+            with timed(self.counter, "parse"):
+                out = handler.parse(handler.pre_parse(blob))
+        except aswan.ConnectionError as e:
+            # e.g. a captcha instead of the page, worth loading again
+            with self._lock:
+                self._retry(lease, e)
+            handler.pop_registered_links()
+            return
+        except Exception as e:
+            out = {"e_type": type(e).__name__, "e_msg": str(e).split("\n")[0]}
+            self._add_event(lease, out, DEFAULT_EXCEPTION_STATUS)
+            return
+        status = (
+            Statuses.PERSISTENT_PROCESSED
+            if handler.process_indefinitely
+            else Statuses.PROCESSED
+        )
+        self.counter["processed"] += 1
+        self._add_event(lease, out, status)
+
+    def _add_event(self, lease: Lease, out, status: str):
+        store = self.project.depot.object_store
+        event = CollEvent(
+            handler=lease.handler,
+            url=lease.url,
+            timestamp=int(time.time()),
+            output_file=store.dump(out) if out is not None else "",
+            status=status,
+        )
+        handler = self.handlers[lease.handler]
+        self._events.extend([event, *handler.pop_registered_links()])
+
+    def _write(self):
+        self._last_write = time.monotonic()
+        if not self._events:
+            return
+        with timed(self.counter, "depot_write"):
+            self.project.depot.current.integrate_events(self._events)
+        self.counter["writes"] += 1
+        self._events = []
+
+
+class ReplayClient:
+    """headless stand-in for the browser extension
+
+    workers threads lease urls and post back stored page sources,
+    a share of the leases can be dropped to exercise re-leasing
+    """
+
+    def __init__(
+        self,
+        pages: dict[str, str],
+        workers: int = 4,
+        delay: float = 0,
+        drop_rate: float = 0,
+        port: int = WEBEXT_PORT,
+        seed: int = 42,
+    ):
+        self.pages = pages
+        self.workers = workers
+        self.delay = delay
+        self.drop_rate = drop_rate
+        self.root = f"http://localhost:{port}"
+        self.counter = Counter()
+        self._rng = random.Random(seed)
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, args=(str(i),), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+
+    def _work(self, worker: str):
+        session = requests.Session()
+        while not self._stop.is_set():
+            try:
+                url = session.get(
+                    f"{self.root}/{WE_URL_ROUTE}", params={"worker": worker}
+                ).text
+            except requests.ConnectionError:
+                time.sleep(0.1)
+                continue
+            if url not in self.pages:
+                time.sleep(0.05)
+                continue
+            time.sleep(self.delay)
+            if self._rng.random() < self.drop_rate:
+                self.counter["dropped"] += 1
+                continue
+            session.post(self.root, json={WE_SOURCE_K: self.pages[url], WE_URL_K: url})
+            self.counter["sent"] += 1
+
+
+def pages_from_depot(project: aswan.Project, handler: type, **event_kwargs) -> dict:
+    """sources of stored webext events by url, to replay with ReplayClient"""
+    return {
+        pcev.url: pcev.content
+        for pcev in project.depot.get_handler_events(handler, **event_kwargs)
+    }
+
+
+def _to_leases(surls) -> list[Lease]:
+    return [Lease(surl.url, surl.handler) for surl in surls]
+
+
+def _get_reg_events(url_dic: Optional[dict], overwrite: bool) -> list[RegEvent]:
+    return [
+        RegEvent(
+            url=handler.extend_link(url), handler=handler.__name__, overwrite=overwrite
+        )
+        for handler, urls in (url_dic or {}).items()
+        for url in urls
+    ]
@@ -0,0 +1,89 @@
+import json
+from typing import TYPE_CHECKING, Iterable
+
+import numpy as np
+import pandas as pd
+
+from .utils import check_missing_col
+
+if TYPE_CHECKING:
+    import datazimmer as dz
+
+
+def quarantine_drift(
+    df: pd.DataFrame,
+    table: "dz.ScruTable",
+    drift: list,
+    ignored: Iterable[str] = (),
+) -> pd.DataFrame:
+    """the frame fit to the table, with what does not fit added to drift
+
+    the columns the table does not have are left out, the non-numeric
+    values of its float columns and the nested values of its str
+    columns are set to NaN, so none of them fails the write of the
+    batch. NaN fails the write of int columns all the same, so the
+    records with non-integer values there are dropped. columns the
+    table has, but the frame is missing, are added empty
+    """
+    entity = table.abstract_entity.__name__
+    df, unknown = check_missing_col(df, table, ignored)
+    for col in unknown.columns:
+        drift.extend(iter_drift_recs(entity, col, unknown[col]))
+    dropped = np.zeros(df.shape[0], dtype=bool)
+    for col, dtype in table.features_map.items():
+        s = df[col]
+        bad = _BAD_VALUE_CHECKS.get(dtype, _no_check)(s)
+        if not bad.any():
+            continue
+        drift.extend(iter_drift_recs(entity, col, s[bad]))
+        if dtype is int:
+            dropped |= bad.to_numpy()
+        else:
+            df[col] = s.mask(bad)
+    return df.loc[~dropped] if dropped.any() else df
+
+
+def iter_drift_recs(entity: str, col: str, s: pd.Series):
+    for key, value in s.dropna().items():
+        yield drift_rec(entity, col, key, value)
+
+
+def drift_rec(entity: str, col: str, key, value) -> tuple[str, str, str, str]:
+    """(entity, column, json of the record index, json of the value)"""
+    key = list(key) if isinstance(key, tuple) else key
+    return entity, col, _to_json(key), _to_json(value)
+
+
+def _to_json(obj) -> str:
+    return json.dumps(obj, default=str, ensure_ascii=False)
+
+
+def _non_numeric(s: pd.Series) -> pd.Series:
+    if pd.api.types.is_numeric_dtype(s):
+        return _no_check(s)
+    return s.notna() & _to_numeric(s).isna()
+
+
+def _non_integer(s: pd.Series) -> pd.Series:
+    if pd.api.types.is_integer_dtype(s) or pd.api.types.is_bool_dtype(s):
+        return _no_check(s)
+    num = s if pd.api.types.is_numeric_dtype(s) else _to_numeric(s)
+    return s.notna() & (num.isna() | (num % 1 != 0))
+
+
+def _nested(s: pd.Series) -> pd.Series:
+    if s.dtype != object:
+        return pd.Series(False, index=s.index)
+    return s.map(lambda v: isinstance(v, (dict, list)))
+
+
+def _no_check(s: pd.Series) -> pd.Series:
+    return pd.Series(False, index=s.index)
+
+
+def _to_numeric(s: pd.Series) -> pd.Series:
+    # nested values are not numbers either
+    return pd.to_numeric(s.mask(_nested(s)), errors="coerce")
+
+
+_BAD_VALUE_CHECKS = {float: _non_numeric, int: _non_integer, str: _nested}
@@ -0,0 +1,78 @@
+from collections import Counter
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from .meta import DTYPE_PLANS, ENUM, FLAG, SMALL_FLOAT, SMALL_INT
+
+INT_DTYPES = ["Int8", "Int16", "Int32", "Int64"]
+
+
+def apply_dtype_plan(
+    df: pd.DataFrame, entity: type, counter: Optional[Counter] = None
+) -> pd.DataFrame:
+    """df with the columns in the dtype plan of the entity converted
+
+    a column is only converted if none of its values change, otherwise
+    it is kept as it is. writing a table still parses the frame to the
+    types declared on the entity, so the logical schema is the same
+    """
+    counter = Counter() if counter is None else counter
+    out = {}
+    for col, kind in DTYPE_PLANS.get(entity, {}).items():
+        if col not in df.columns:
+            continue
+        converted = _CONVERTERS[kind](df[col])
+        if converted is None:
+            counter["dtype_plan_skipped"] += 1
+        else:
+            out[col] = converted
+    return df.assign(**out) if out else df
+
+
+def _to_flag(s: pd.Series) -> Optional[pd.Series]:
+    # True and False match 1 and 0 here
+    if not s.dropna().isin([0, 1]).all():
+        return None
+    return s.astype("boolean")
+
+
+def _to_enum(s: pd.Series) -> Optional[pd.Series]:
+    try:
+        return s.astype("category")
+    except TypeError:
+        # e.g. dicts in the column
+        return None
+
+
+def _to_small_int(s: pd.Series) -> Optional[pd.Series]:
+    values = s.dropna()
+    if pd.api.types.is_bool_dtype(s) or not pd.api.types.is_numeric_dtype(s):
+        return None
+    if not (values % 1 == 0).all():
+        return None
+    low, high = (values.min(), values.max()) if values.size else (0, 0)
+    for dtype in INT_DTYPES:
+        info = np.iinfo(dtype.lower())
+        if (info.min <= low) and (high <= info.max):
+            # plain numpy ints if there is nothing missing
+            return s.astype(dtype if values.size < s.size else dtype.lower())
+    return None
+
+
+def _to_small_float(s: pd.Series) -> Optional[pd.Series]:
+    if not pd.api.types.is_float_dtype(s):
+        return None
+    small = s.astype("float32")
+    if not small.astype(s.dtype).equals(s):
+        return None
+    return small
+
+
+_CONVERTERS = {
+    FLAG: _to_flag,
+    ENUM: _to_enum,
+    SMALL_INT: _to_small_int,
+    SMALL_FLOAT: _to_small_float,
+}
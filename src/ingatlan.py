@@ -1,18 +1,25 @@
-import json
-import re
+import os
 import time
-from itertools import islice
-from typing import Iterable, Union
+from functools import partial
+from typing import Iterable, Optional, Union
 
 import aswan
 import datazimmer as dz
 import numpy as np
 import pandas as pd
-import psutil
 from aswan.utils import add_url_params
-from atqo import parallel_map
-from bs4 import BeautifulSoup
-
+from structlog import get_logger
+
+from .compaction import (
+    check_columns,
+    collect_lock,
+    compact_paths,
+    get_write_paths,
+    migrate_table,
+)
+from .decode import decode_ad_batch, iter_dim_recs
+from .drift import quarantine_drift
+from .dtypes import apply_dtype_plan
 from .meta import (
     Contact,
     Heating,
@@ -25,20 +32,38 @@ from .meta import (
     Seller,
     UtilityCost,
 )
+from .metrics import RunMetrics, timed, timed_iter
 from .parse import (
-    parse_contact,
-    parse_heating,
-    parse_label,
-    parse_listing,
-    parse_location,
-    parse_parking,
-    parse_price,
-    parse_property,
-    parse_seller,
-    parse_utility_cost,
+    extract_listing_payloads,
+    get_ad_id,
+    pack_listing_cards,
+    parse_cards,
+    parse_listings,
+    scan_ad_links,
+)
+from .rate import RateControlledMixin, read_rate_metrics
+from .reader import (
+    TimeBound,
+    all_of,
+    id_filter,
+    read_filtered,
+    time_filter,
 )
+from .scheduling import AdaptiveScheduler, CollectBudget, get_peak_rss
+from .stores import BlobStore, DriftStore, SqliteKV, hash_payloads, is_blob_ref
+from .writer import CoalescingWriter, ParsedBatch
+
+logger = get_logger(ctx="ingatlan")
 
 SLEEP_TIME = 2
+# bump to re-parse every ad, even if its payloads did not change
+AD_HASH_VERSION = 1
+# an ad is fetched again if any of these change on its listing card
+DELTA_CARD_FIELDS = [
+    RealEstateRecord.price,
+    RealEstateRecord.photo_count,
+    RealEstateRecord.area_size,
+]
 
 ing_url = dz.SourceUrl("https://ingatlan.com")
 
@@ -46,50 +71,86 @@ rent_query = "kiado"
 sale_query = "elado"
 
 
-class AdHandler(aswan.RequestHandler):
+class PacedHandlerMixin(RateControlledMixin):
+    rate_controller_kwargs = {"initial_delay": SLEEP_TIME}
+
+    def get_rate_metrics_dir(self):
+        return get_rate_metrics_dir()
+
+
+class AdHandler(PacedHandlerMixin, aswan.RequestHandler):
     max_in_parallel = 1
     process_indefinitely: bool = True
     url_root = ing_url
 
     def parse(self, blob):
+        # the card of the ad counts as seen only once the ad itself is in
+        ad_id = get_ad_id(self._url.removeprefix(self.url_root))
+        get_listing_seen_index().set_many(get_listing_pending_index().get_many([ad_id]))
         return blob
 
     def is_session_broken(self, result: Union[int, Exception]):
-        if isinstance(result, int):
-            if result == 410:
-                "No longer available"
-                return False
-            elif result == 404:
-                "Cannot be found"
-                return False
-        return True
-
-    @staticmethod
-    def get_sleep_time():
-        return SLEEP_TIME
-
-    def start_session(self, _):
-        time.sleep(60 * 5)
+        if super().is_session_broken(result):
+            # 404 is cannot be found, 410 is no longer available
+            return result != 410
+        return False
 
 
-class ListingHandler(aswan.RequestSoupHandler):
+class ListingHandler(PacedHandlerMixin, aswan.RequestHandler):
     max_in_parallel = 1
-
-    def parse(self, soup: "BeautifulSoup"):
-        # ad_ids = [int(e.get("data-id")) for e in soup.select(".listing")]
-        ad_ids = [s["href"][1:] for s in soup.find_all("a", href=re.compile(r"^/\d+"))]
+    # keeps the whole page instead of the packed cards, for debugging
+    store_full_page: bool = bool(os.environ.get("INGATLAN_LISTING_FULL_PAGE"))
+    # only ads that are new, changed on their card or were not registered
+    # for max_ad_age_days are sent to AdHandler, unless full crawling
+    delta_crawl: bool = not os.environ.get("INGATLAN_FULL_CRAWL")
+    max_ad_age_days: float = float(os.environ.get("INGATLAN_AD_MAX_AGE_DAYS", 7))
+
+    def parse(self, blob: bytes):
+        packed = pack_listing_cards(blob)
+        hrefs = list(dict.fromkeys(scan_ad_links(blob)))
+        due_hrefs = []
+        if self.delta_crawl:
+            hrefs, due_hrefs = self._split_due_hrefs(hrefs, parse_cards(packed))
+        self._register_ads(hrefs)
+        # ads fetched before are already processed in aswan, these need
+        # to be reset to be fetched again
+        self._register_ads(due_hrefs, overwrite=True)
+        if self.store_full_page:
+            return blob
+        return packed
+
+    def _register_ads(self, hrefs: list[str], overwrite: bool = False):
         self.register_links_to_handler(
-            links=[f"{AdHandler.url_root}/{ad_id}" for ad_id in ad_ids],
+            links=[f"{AdHandler.url_root}/{href}" for href in hrefs],
             handler_cls=AdHandler,
+            overwrite=overwrite,
         )
-        return soup.encode("utf-8")
-
-    @staticmethod
-    def get_sleep_time():
-        return SLEEP_TIME
 
-    def start_session(self, _):
-        time.sleep(60 * 5)
+    def _split_due_hrefs(
+        self, hrefs: list[str], cards: list[dict]
+    ) -> tuple[list[str], list[str]]:
+        """links without a parsed card and links of the due cards"""
+        sigs = {}
+        for card in cards:
+            ad_id = get_ad_id(card[RealEstateRecord.property_id.id] or "")
+            if ad_id:
+                sigs[ad_id] = hash_payloads([card[k] for k in DELTA_CARD_FIELDS])
+        index = get_listing_seen_index()
+        min_time = time.time() - self.max_ad_age_days * 24 * 60 * 60
+        known = index.get_many(sigs.keys(), newer_than=min_time)
+        due = {ad_id: sig for ad_id, sig in sigs.items() if known.get(ad_id) != sig}
+        # moved to the seen index by AdHandler once the ad is fetched
+        get_listing_pending_index().set_many(due)
+        # links without a parsed card are always registered
+        cardless = [h for h in hrefs if get_ad_id(h) not in sigs]
+        due_hrefs = [h for h in hrefs if get_ad_id(h) in due]
+        logger.debug(
+            "delta crawl",
+            links=len(hrefs),
+            cards=len(sigs),
+            due=len(cardless) + len(due_hrefs),
+        )
+        return cardless, due_hrefs
 
 
 class InitHandler(aswan.RequestJsonHandler):
@@ -131,6 +192,7 @@ label_table = dz.ScruTable(Label)
 location_table = dz.ScruTable(Location)
 
 
+# known fields the tables leave out, not reported as drift
 UNUSED_COLS = [
     "stripped_photos",
     "photo_url",
@@ -145,58 +207,240 @@ UNUSED_COLS = [
     "street_number_coordinates",
 ]
 
-PARSER_MAPPING = {
-    "utility_costs": (parse_utility_cost, utility_cost_table),
-    "prices": (parse_price, price_table),
-    "contact_phone_numbers": (parse_contact, contact_table),
-    "heating_types": (parse_heating, heating_table),
-    "parking": (parse_parking, parking_table),
-    "labels": (parse_label, label_table),
-    "seller": (parse_seller, seller_table),
+# stored in the blob store with only a ref in the table,
+# if blob_store is set in the collect budget
+BLOB_COLUMNS = {
+    RealEstate: [RealEstate.description],
+    Location: [Location.polygon],
 }
 
+# read lookups go by these, so the tables are compacted sorted by them
+READ_SORTING = {
+    property_table: [RealEstate.id],
+    property_rec_table: [RealEstateRecord.property_id.id, RealEstateRecord.recorded],
+    price_table: [Price.property_id.id],
+    seller_table: [Seller.id],
+    location_table: [Location.id],
+}
 
-def parse_ad_pcev(pcevs: Iterable["aswan.ParsedCollectionEvent"]):
-    data_elems = [
-        BeautifulSoup(pcev.content, "html5lib").select_one("#listing") for pcev in pcevs
-    ]
+TABLE_MAPPING = {
+    UtilityCost: utility_cost_table,
+    Price: price_table,
+    Contact: contact_table,
+    Heating: heating_table,
+    Parking: parking_table,
+    Label: label_table,
+    Seller: seller_table,
+    RealEstate: property_table,
+    Location: location_table,
+}
 
-    # PROPERTY PARSING
-    property_df = pd.DataFrame(
-        [json.loads(de.get("data-listing")) for de in data_elems]
-    ).pipe(parse_property)
 
-    for colname, (parser, table) in PARSER_MAPPING.items():
-        if property_df[colname].astype(bool).any():
-            table.replace_records(
-                parser(property_df).reindex(table.feature_cols, axis=1)
+def parse_ad_pcev(
+    pcevs: Iterable["aswan.ParsedCollectionEvent"], use_blob_store: bool = False
+) -> ParsedBatch:
+    batch = ParsedBatch()
+    payloads = {}
+    for pcev in pcevs:
+        batch.counter["pages"] += 1
+        listing, hierarchy = extract_listing_payloads(pcev.content, batch.counter)
+        pid = listing[RealEstate.id]
+        if pid not in batch.hashes:
+            batch.hashes[pid] = hash_payloads(AD_HASH_VERSION, listing, hierarchy)
+            payloads[pid] = (listing, hierarchy)
+    with timed(batch.counter, "hash_lookup"):
+        known = get_ad_hash_index().get_many(batch.hashes.keys())
+    changed = [payloads[pid] for pid, h in batch.hashes.items() if known.get(pid) != h]
+    batch.counter["unchanged"] += len(payloads) - len(changed)
+    batch.counter["changed"] += len(changed)
+    if changed:
+        dim_hashes = {}
+        for key, rec in iter_dim_recs(changed):
+            if key not in dim_hashes:
+                dim_hashes[key] = hash_payloads(AD_HASH_VERSION, rec)
+        with timed(batch.counter, "hash_lookup"):
+            known_dims = get_dim_hash_index().get_many(dim_hashes.keys())
+        batch.dim_hashes = {
+            k: h for k, h in dim_hashes.items() if known_dims.get(k) != h
+        }
+        batch.counter["unchanged_dims"] += len(dim_hashes) - len(batch.dim_hashes)
+        with timed(batch.counter, "flatten"):
+            batch.replace = decode_ad_batch(
+                changed,
+                skip_dims=dim_hashes.keys() - batch.dim_hashes.keys(),
+                drift=batch.drift,
             )
+        with timed(batch.counter, "drift_check"):
+            batch.replace = {
+                entity: quarantine_drift(
+                    df, TABLE_MAPPING[entity], batch.drift, UNUSED_COLS
+                )
+                for entity, df in batch.replace.items()
+            }
+        batch.counter["records"] += sum(df.shape[0] for df in batch.replace.values())
+        with timed(batch.counter, "dtype_plan"):
+            batch.replace = {
+                entity: apply_dtype_plan(df, entity, batch.counter)
+                for entity, df in batch.replace.items()
+            }
+    if use_blob_store and batch.replace:
+        blob_store = get_blob_store()
+        for entity, cols in BLOB_COLUMNS.items():
+            df = batch.replace.get(entity)
+            for col in cols if df is not None else []:
+                with timed(batch.counter, "blob_store"):
+                    df[col] = blob_store.externalize(df[col])
+    return batch
+
+
+def parse_listing_pcev(pcevs: Iterable["aswan.ParsedCollectionEvent"]) -> ParsedBatch:
+    batch = ParsedBatch()
+    df = parse_listings(pcevs, batch.counter)
+    with timed(batch.counter, "dtype_plan"):
+        batch.extend[RealEstateRecord] = apply_dtype_plan(
+            df, RealEstateRecord, batch.counter
+        )
+    return batch
+
 
-    property_table.replace_records(property_df)
+def get_ad_hash_index():
+    return SqliteKV(dz.get_raw_data_path("ad-hashes.sqlite"), "ad_hashes")
 
-    # LOCATION PARSING
-    pd.DataFrame(
-        [json.loads(de.get("data-location-hierarchy")) for de in data_elems]
-    ).pipe(parse_location).pipe(location_table.replace_records)
 
+def get_blob_store():
+    return BlobStore(dz.get_raw_data_path("blobs.sqlite"))
 
-def parse_listing_pcev(pcevs: Iterable["aswan.ParsedCollectionEvent"]):
-    df = pd.concat(map(parse_listing, pcevs))
-    if not df.empty:
-        property_rec_table.extend(df)
+
+def resolve_blob_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """texts in place of the blob refs of a property or location frame"""
+    blob_cols = [
+        c
+        for cols in BLOB_COLUMNS.values()
+        for c in cols
+        if (c in df.columns) and df[c].map(is_blob_ref).any()
+    ]
+    if not blob_cols:
+        return df
+    blob_store = get_blob_store()
+    return df.assign(**{c: blob_store.resolve(df[c]) for c in blob_cols})
+
+
+def get_history(
+    property_ids: Optional[Iterable[int]] = None,
+    since: TimeBound = None,
+    until: TimeBound = None,
+    columns: Optional[list[str]] = None,
+) -> pd.DataFrame:
+    """listing records of the properties, recorded in [since, until)"""
+    rec = RealEstateRecord
+    return read_filtered(
+        property_rec_table,
+        all_of(
+            id_filter(rec.property_id.id, property_ids),
+            time_filter(rec.recorded, since, until),
+        ),
+        _with_index(columns, [rec.property_id.id, rec.recorded]),
+    )
+
+
+def get_current(
+    property_ids: Iterable[int], with_seller=True, with_location=True
+) -> pd.DataFrame:
+    """properties with their seller and location as prefixed columns"""
+    df = read_filtered(property_table, id_filter(RealEstate.id, property_ids))
+    for add, table, id_col, fk, prefix in [
+        (with_seller, seller_table, Seller.id, RealEstate.seller_id.id, "seller__"),
+        (
+            with_location,
+            location_table,
+            Location.id,
+            RealEstate.location_id.id,
+            "location__",
+        ),
+    ]:
+        if not add or df.empty:
+            continue
+        ids = df[fk].dropna().unique().tolist()
+        dim_df = read_filtered(table, id_filter(id_col, ids)).pipe(resolve_blob_columns)
+        df = df.join(dim_df.add_prefix(prefix), on=fk)
+    return df.pipe(resolve_blob_columns)
+
+
+def get_prices(property_ids: Iterable[int]) -> pd.DataFrame:
+    return read_filtered(price_table, id_filter(Price.property_id.id, property_ids))
+
+
+def _with_index(columns: Optional[list[str]], index_cols: list[str]):
+    if columns is None:
+        return None
+    return [*index_cols, *(c for c in columns if c not in index_cols)]
+
+
+def get_dim_hash_index():
+    return SqliteKV(dz.get_raw_data_path("dimension-hashes.sqlite"), "dim_hashes")
+
+
+def get_drift_store():
+    return DriftStore(dz.get_raw_data_path("schema-drift.sqlite"))
+
+
+def get_listing_seen_index():
+    return SqliteKV(dz.get_raw_data_path("listing-seen.sqlite"), "listing_cards")
+
+
+def get_listing_pending_index():
+    """card hashes of the registered ads not fetched yet"""
+    return SqliteKV(dz.get_raw_data_path("listing-seen.sqlite"), "pending_cards")
+
+
+def get_rate_metrics_dir():
+    """where the crawl processes leave the metrics of their rate controllers"""
+    return dz.get_raw_data_path("rate-metrics")
 
 
 @dz.register_data_loader(extra_deps=[PropertyRentDzA])
+@collect_lock()
 def collect():
-    batch_size = 200
-    workers = int(psutil.virtual_memory().available / 10**9 / 2.5)
-    pairs = [(AdHandler, parse_ad_pcev), (ListingHandler, parse_listing_pcev)]
-    for handler_cls, fun in pairs:
-        it = batched(PropertyRentDzA().get_unprocessed_events(handler_cls), batch_size)
-        list(parallel_map(fun, it, pbar=True, verbose=True, workers=workers))
-
-
-def batched(iterable, n):
-    it = iter(iterable)
-    while batch := list(islice(it, n)):
-        yield batch
+    budget = CollectBudget.load()
+    metrics = RunMetrics("ingatlan")
+    writer = CoalescingWriter(
+        TABLE_MAPPING | {RealEstateRecord: property_rec_table},
+        max_rows=budget.write_chunk_rows,
+        hash_index=get_ad_hash_index(),
+        dim_index=get_dim_hash_index(),
+        drift_store=get_drift_store(),
+    )
+    for table in writer.tables.values():
+        migrate_table(table)
+    for handler_cls, fun in [
+        (AdHandler, partial(parse_ad_pcev, use_blob_store=budget.blob_store)),
+        (ListingHandler, parse_listing_pcev),
+    ]:
+        name = handler_cls.__name__
+        it = timed_iter(
+            PropertyRentDzA().get_unprocessed_events(handler_cls),
+            metrics.counter,
+            f"{name}:load_events",
+        )
+        scheduler = AdaptiveScheduler(budget)
+        for batch in scheduler.map(fun, it, pbar=True, verbose=True):
+            writer.add(batch)
+        writer.flush()
+        logger.info("parsed", handler=name, **writer.counter)
+        metrics.update(writer.counter, prefix=f"{name}:")
+        writer.counter.clear()
+        for stats in scheduler.stats:
+            metrics.add_peak_rss(f"{name}:{stats.worker}", stats.peak_rss)
+    for table in writer.tables.values():
+        check_columns(table)
+    if budget.compact_tables:
+        for table, by in READ_SORTING.items():
+            with metrics.timed(f"compact_{table.name}"):
+                compact_paths(get_write_paths(table), by, table.name)
+    metrics.add_peak_rss("main", get_peak_rss())
+    # the handlers ran in the crawl processes
+    metrics.extra["rate"] = read_rate_metrics(get_rate_metrics_dir())
+    metrics.extra["drift"] = dict(writer.drift_counts)
+    metrics.emit(
+        [f"- schema drift in {k}: {n} values" for k, n in writer.drift_counts.items()]
+    )
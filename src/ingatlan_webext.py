@@ -1,21 +1,34 @@
 import json
 import os
 import re
-from datetime import date
+import shutil
+import signal
+from collections import Counter
 from pathlib import Path
 from subprocess import Popen
-from time import sleep
+from time import sleep, time
+from typing import Optional
 
 import aswan
+import lxml.html
 import pandas as pd
 import unidecode
 from aswan.constants import WE_SOURCE_K
 from bs4 import BeautifulSoup
 from dotenv import load_dotenv
+from lxml import etree
 from parquetranger import TableRepo
 from structlog import get_logger
 from tqdm import tqdm
 
+from .compaction import collect_lock
+from .dispatch import UrlDispatcher
+from .metrics import RunMetrics, timed, timed_iter
+from .parse import parse_hu_number
+from .scheduling import get_peak_rss
+from .stores import ListingStatusStore, SqliteKV, hash_content
+from .utils import batched, ordered_pool_map
+
 load_dotenv()
 
 logger = get_logger(ctx="ingatlan-webext")
@@ -33,9 +46,45 @@ init_urls = [search_init_url, sale_init_url]
 
 
 search_trepo = TableRepo(
-    f"{EXPORT_ROOT}/search-results-v2", group_cols="collection_week"
+    f"{EXPORT_ROOT}/search-results-v3", group_cols="collection_week"
 )
 detail_trepo = TableRepo(f"{EXPORT_ROOT}/details-v2", group_cols="id_last_digit")
+# the search export before the typed columns, no longer written,
+# its files are moved to search_trepo by migrate_old_search_results
+OLD_SEARCH_ROOT = Path(EXPORT_ROOT, "search-results-v2")
+MIGRATED_SUFFIX = ".migrated"
+
+# pages sent to a parsing process at once
+PARSE_CHUNK = 16
+# records cleaned and written to the export tables at once
+EXPORT_CHUNK = 50_000
+
+SEARCH_CARD_VALUE_ATT = "data-listings-page--results-listing-listing-value"
+SEARCH_PRICE_RE = re.compile(r".*\s+Ft/hó.*")
+
+
+def _has_class(c: str) -> str:
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {c} ')"
+
+
+_SEARCH_CARDS = etree.XPath(f"//a[{_has_class('listing-card')}]")
+_CARD_TEXTS = etree.XPath(".//text()")
+_TOTAL_TEXTS = etree.XPath("//text()[contains(., 'találat')]")
+_CARD_ATT_ROOT = etree.XPath(
+    ".//*[@class='d-flex flex-column justify-content-between h-100']"
+)
+_CARD_ATTS = etree.XPath(
+    f"(.//div[{_has_class('justify-content-start')}])[1]"
+    f"//div[{_has_class('d-flex')}]"
+)
+_ATT_SPANS = etree.XPath(".//span")
+_CARD_LOCS = [
+    etree.XPath(f".//span[@class='{c}']")
+    for c in [
+        "d-block fw-500 fs-7 text-onyx font-family-secondary",
+        "d-block fs-7 text-gray-900",
+    ]
+]
 
 cols = [
     "id",
@@ -52,7 +101,14 @@ cols = [
     "erkely",
     "telekterulet",
     "vendor_url",
+    "felszobak",
 ]
+# display strings kept next to the parsed columns as <col>_raw
+SEARCH_RAW_COLS = ["price", "alapterulet", "szobak", "erkely", "telekterulet"]
+# plain strings, as the table schema is fixed by the first chunk written,
+# and categoricals there would fix a dictionary index width too small
+# for later chunks. parquet dictionary encodes them on disk anyway
+SEARCH_TEXT_COLS = ["city", "loc", "vendor_url"]
 
 
 @project.register_handler
@@ -64,21 +120,18 @@ class WH(aswan.WebExtHandler):
     def parse(self, we_resp: bytes):
         we_resp_dic: dict = json.loads(we_resp)
         source = we_resp_dic[WE_SOURCE_K]
-        soup = BeautifulSoup(source, "html5lib")
+        doc = lxml.html.document_fromstring(source)
         if self._url in init_urls:
             n_total = int(
-                "".join(
-                    soup.find(string=re.compile(".*találat"))
-                    .replace("találat", "")
-                    .strip()
-                    .split()
-                )
+                "".join(_TOTAL_TEXTS(doc)[0].replace("találat", "").strip().split())
             )
             self.register_links_to_handler(
                 [f"{self._url}?page={i}" for i in range(2, n_total // 20 + 2)]
             )
-        if len(soup.find_all("a", class_="listing-card")) == 0:
+        page = search_page_from_doc(doc)
+        if len(page["hrefs"]) == 0:
             raise aswan.ConnectionError("no listings")
+        get_search_page_index().set_many({hash_content(source): json.dumps(page)})
         return source
 
 
@@ -89,233 +142,396 @@ class WhOnce(aswan.WebExtHandler):
     max_retries = 250
 
 
-def run_details(non_clicked):
+def run_details(non_clicked, tabs: int = 1, counter: Optional[Counter] = None):
     rentals = []
     logger.info("adding detail pages for parsing")
     for pcev in project.depot.get_handler_events(WH, from_current=True):
         if "elado" in pcev.url:
             continue
-        for a in BeautifulSoup(pcev.content, "html5lib").find_all(
-            "a", class_="listing-card"
-        ):
-            rentals.append(url_root + a["href"].split("?")[0])
-    project.continue_run(
+        for href in get_search_page(pcev)["hrefs"]:
+            rentals.append(url_root + href.split("?")[0])
+    run_webext(
+        tabs,
+        counter=counter,
         urls_to_register={WhOnce: rentals},
         urls_to_overwrite={WhOnce: non_clicked},
-        force_sync=True,
     )
     return rentals
 
 
-def get_search_recs(past_runs=1):
-    for pcev in tqdm(
-        project.depot.get_handler_events(WH, only_latest=False, past_runs=past_runs),
-        "search pcevs",
+def run_webext(
+    tabs: int = 1, new_run=False, counter: Optional[Counter] = None, **url_dics
+):
+    """runs the project with aswan, or leases the urls to several tabs"""
+    if tabs > 1:
+        dispatcher = UrlDispatcher(project, [WH, WhOnce])
+        dispatcher.run(new_run=new_run, **url_dics)
+        if counter is not None:
+            counter.update(dispatcher.counter)
+    elif new_run:
+        project.run(**url_dics, force_sync=True)
+    else:
+        project.continue_run(**url_dics, force_sync=True)
+
+
+def get_search_recs(
+    past_runs=1,
+    workers: Optional[int] = 1,
+    chunk_size=PARSE_CHUNK,
+    counter: Optional[Counter] = None,
+):
+    counter = Counter() if counter is None else counter
+    pcevs = project.depot.get_handler_events(WH, only_latest=False, past_runs=past_runs)
+    for recs, page_counter in ordered_pool_map(
+        _search_recs_of_pcev,
+        (pcev for pcev in tqdm(pcevs, "search pcevs") if "elado" not in pcev.url),
+        workers=workers,
+        chunk_size=chunk_size,
     ):
-        if "elado" in pcev.url:
-            continue
-        for d in search_results_from_pcev(pcev):
-            yield d
+        counter.update(page_counter)
+        yield from recs
+    logger.info("parsed search cards", **counter)
+
+
+def _search_recs_of_pcev(pcev) -> tuple[list[dict], Counter]:
+    counter = Counter(pages=1)
+    with timed(counter, "search_parse"):
+        recs = list(search_results_from_pcev(pcev, counter))
+    counter["records"] += len(recs)
+    return recs, counter
 
 
 def search_result_df_from_pcev(pcev):
     return pd.DataFrame(search_results_from_pcev(pcev))
 
 
-def search_results_from_pcev(pcev):
-    soup = BeautifulSoup(pcev.content, "lxml")
+def search_results_from_pcev(pcev, counter: Optional[Counter] = None):
     try:
         page_n = int(pcev.url.split("=")[-1])
     except ValueError:
         page_n = 1
-    for ablock in soup.find_all("a", class_="listing-card"):
-        subd = json.loads(
-            ablock.get("data-listings-page--results-listing-listing-value", "{}")
-        )
-        root_att_class = "d-flex flex-column justify-content-between h-100"
-        att_dic = {}
-        att_root = ablock.find(class_=root_att_class)
-        if att_root is not None:
-            for d in att_root.find("div", class_="justify-content-start").find_all(
-                "div", class_="d-flex"
-            ):
-                k, v = (s.text for s in d.find_all("span"))
-                att_dic[k] = v
-        else:
-            print(
-                "---failed to find att_dir--- \n\n",
-                ablock,
-                "\n\n\n\n",
-                ablock.find(class_=root_att_class.split()),
-                "\n" * 20,
-            )
-        if not att_dic:
-            ValueError("not found att root")
-        loc_classes = [
-            "d-block fw-500 fs-7 text-onyx font-family-secondary",
-            "d-block fs-7 text-gray-900",
-        ]
-        loc_elem = None
-        for class_ in loc_classes:
-            loc_elem = ablock.find("span", class_=class_)
-            if loc_elem is not None:
-                break
-        try:
-            loc = loc_elem.text
-        except:
-            loc = ""
-            print("no loc elem for", att_dic)
-
-        yield (
+    collected = pd.to_datetime(pcev.cev.timestamp, unit="s").isoformat()
+    for card in get_search_page(pcev, counter)["cards"]:
+        yield {"page_no": page_n} | card | {"collected": collected}
+
+
+def get_search_page(pcev, counter: Optional[Counter] = None) -> dict:
+    """hrefs and records of the listing cards on a search page
+
+    read from the index filled in WH.parse, pages not in the
+    index, as it is pruned after each export, are parsed
+    """
+    counter = Counter() if counter is None else counter
+    content = pcev.content
+    if isinstance(content, bytes):
+        content = content.decode("utf-8")
+    if not content.strip():
+        return {"hrefs": [], "cards": []}
+    indexed = get_search_page_index().get_many([hash_content(content)])
+    if indexed:
+        counter["indexed_pages"] += 1
+        return json.loads(*indexed.values())
+    counter["parsed_pages"] += 1
+    return search_page_from_doc(lxml.html.document_fromstring(content), counter)
+
+
+def search_page_from_doc(doc, counter: Optional[Counter] = None) -> dict:
+    """reads every card with the precompiled xpaths below
+
+    missing parts of a card are counted instead of failing
+    """
+    counter = Counter() if counter is None else counter
+    page = {"hrefs": [], "cards": []}
+    for card in _SEARCH_CARDS(doc):
+        counter["cards"] += 1
+        subd = json.loads(card.get(SEARCH_CARD_VALUE_ATT, "{}"))
+        if (href := card.get("href")) is not None:
+            page["hrefs"].append(href)
+        page["cards"].append(
             {
-                "page_no": page_n,
-                "price": getattr(
-                    ablock.find(string=re.compile(r".*\s+Ft/hó.*")), "text", ""
-                ),
-                "loc": loc,
+                "price": _get_card_price(card, counter),
+                "loc": _get_card_loc(card, counter),
             }
-            | att_dic
+            | _get_card_atts(card, counter)
             | subd.pop("seller", {})
             | subd
-            | {"data_id": ablock.get("data-listing-id")}
-            | {"collected": pd.to_datetime(pcev.cev.timestamp, unit="s").isoformat()}
+            | {"data_id": card.get("data-listing-id")}
         )
+    return page
+
+
+def _get_card_price(card, counter: Counter) -> str:
+    for text in _CARD_TEXTS(card):
+        if SEARCH_PRICE_RE.search(text):
+            return str(text)
+    counter["missing_price"] += 1
+    return ""
+
+
+def _get_card_loc(card, counter: Counter) -> str:
+    for loc_xpath in _CARD_LOCS:
+        if loc_elems := loc_xpath(card):
+            return loc_elems[0].text_content()
+    counter["missing_loc"] += 1
+    return ""
+
+
+def _get_card_atts(card, counter: Counter) -> dict:
+    att_roots = _CARD_ATT_ROOT(card)
+    if not att_roots:
+        counter["missing_att_root"] += 1
+        return {}
+    att_dic = {}
+    for att_div in _CARD_ATTS(att_roots[0]):
+        spans = _ATT_SPANS(att_div)
+        if len(spans) != 2:
+            counter["malformed_att"] += 1
+            continue
+        k, v = (s.text_content() for s in spans)
+        att_dic[k] = v
+    return att_dic
 
 
-def get_search_df(last_n=1):
-    return pd.DataFrame(get_search_recs(last_n)).pipe(clean_search_df)
+def get_search_df(last_n=1, workers: Optional[int] = 1):
+    return pd.DataFrame(get_search_recs(last_n, workers)).pipe(clean_search_df)
 
 
 def clean_search_df(df):
+    df = df.rename(columns=lambda s: unidecode.unidecode(s.lower())).rename(
+        columns={"websiteurl": "vendor_url"}
+    )
+    raw = df.reindex(SEARCH_RAW_COLS, axis=1).astype("string")
     return (
-        df.rename(columns=lambda s: unidecode.unidecode(s.lower()))
-        .rename(columns={"websiteurl": "vendor_url"})
-        .reindex(cols, axis=1)
+        df.reindex(cols, axis=1)
         .assign(
-            collection_week=lambda df: df["collected"]
-            .pipe(pd.to_datetime)
-            .dt.to_period("W")
-            .apply(lambda r: r.start_time.date().isoformat())
+            collected=lambda df: pd.to_datetime(df["collected"]),
+            collection_week=lambda df: _week_start(df["collected"]),
+            price=parse_hu_number(raw["price"]),
+            alapterulet=parse_hu_number(raw["alapterulet"]),
+            erkely=parse_hu_number(raw["erkely"]),
+            telekterulet=parse_hu_number(raw["telekterulet"]),
+            szobak=parse_hu_number(
+                raw["szobak"].str.extract(r"^\s*(\d+)\s*(?:\+|$)")[0]
+            ),
+            felszobak=parse_hu_number(raw["szobak"].str.extract(r"(\d+)\s*fél")[0]),
+            **{c: lambda df, c=c: df[c].astype("string") for c in SEARCH_TEXT_COLS},
         )
+        .join(raw.add_suffix("_raw"))
     )
 
 
-def get_detail_recs(last_n=1):
-    for opcev in tqdm(
-        project.depot.get_handler_events(WhOnce, only_latest=False, past_runs=last_n),
-        "detail pcevs",
-    ):
-        soup = BeautifulSoup(opcev.content, "lxml")
-        number_elem = soup.find(class_="contact-phone-number")
-        number_revealed = False
-        gone = (
-            soup.find("img", src="https://ingatlan.com/images/error-404.svg")
-            is not None
-        )
-        number = ""
-        if number_elem is not None:
-            number = number_elem.text
-            if number != "%number%":
-                number_revealed = True
-
-        hero_div = soup.find("div", id="hero-contact")
-        seller_info = {
-            e.text.split()[0].lower(): e["href"]
-            for e in soup.find_all("a", string=re.compile("sszes hird"))
-        }
-        if hero_div is not None:
-            for k, clss in [
-                ("seller_main", ["text-onyx", "fs-6"]),
-                ("seller_sub", ["d-block", "fs-7"]),
-            ]:
-                seller_info[k] = getattr(hero_div.find(class_=clss), "text", "")
-
-        yield (
-            {
-                "id": int(opcev.url.split("/")[-1].split("?")[0]),
-                "number_present": number_elem is not None,
-                "number_revealed": number_revealed,
-                "listing_gone": gone,
-                "collected": pd.to_datetime(opcev.cev.timestamp, unit="s").isoformat(),
-                "phone_number": number,
-            }
-            | seller_info
-        )
+def _week_start(dt: pd.Series) -> pd.Series:
+    monday = dt.dt.normalize() - pd.to_timedelta(dt.dt.weekday, unit="D")
+    return monday.dt.strftime("%Y-%m-%d")
 
 
-def dump_last_get_nonclicked(last_n=1):
+def get_detail_recs(last_n=1, workers: Optional[int] = 1, chunk_size=PARSE_CHUNK):
+    yield from ordered_pool_map(
+        detail_rec_from_pcev,
+        tqdm(
+            project.depot.get_handler_events(
+                WhOnce, only_latest=False, past_runs=last_n
+            ),
+            "detail pcevs",
+        ),
+        workers=workers,
+        chunk_size=chunk_size,
+    )
+
+
+def detail_rec_from_pcev(opcev):
+    soup = BeautifulSoup(opcev.content, "lxml")
+    number_elem = soup.find(class_="contact-phone-number")
+    number_revealed = False
+    gone = soup.find("img", src="https://ingatlan.com/images/error-404.svg") is not None
+    number = ""
+    if number_elem is not None:
+        number = number_elem.text
+        if number != "%number%":
+            number_revealed = True
+
+    hero_div = soup.find("div", id="hero-contact")
+    seller_info = {
+        e.text.split()[0].lower(): e["href"]
+        for e in soup.find_all("a", string=re.compile("sszes hird"))
+    }
+    if hero_div is not None:
+        for k, clss in [
+            ("seller_main", ["text-onyx", "fs-6"]),
+            ("seller_sub", ["d-block", "fs-7"]),
+        ]:
+            seller_info[k] = getattr(hero_div.find(class_=clss), "text", "")
+
+    return {
+        "id": int(opcev.url.split("/")[-1].split("?")[0]),
+        "number_present": number_elem is not None,
+        "number_revealed": number_revealed,
+        "listing_gone": gone,
+        "collected": pd.to_datetime(opcev.cev.timestamp, unit="s").isoformat(),
+        "phone_number": number,
+    } | seller_info
+
+
+def migrate_old_search_results() -> int:
+    """cleans the records of the old search export into search_trepo
+
+    every file done is moved under search-results-v2.migrated,
+    so none of them is added twice, and the old directory is gone
+    once all of them are
+    """
+    if not OLD_SEARCH_ROOT.exists():
+        return 0
+    done_root = OLD_SEARCH_ROOT.with_name(OLD_SEARCH_ROOT.name + MIGRATED_SUFFIX)
+    n = 0
+    for path in sorted(OLD_SEARCH_ROOT.rglob("*.parquet")):
+        df = pd.read_parquet(path)
+        search_trepo.extend(df.pipe(clean_search_df))
+        done_path = done_root / path.relative_to(OLD_SEARCH_ROOT)
+        done_path.parent.mkdir(exist_ok=True, parents=True)
+        path.rename(done_path)
+        n += len(df)
+    # schema files and the like go along, only empty directories are removed
+    for path in [p for p in OLD_SEARCH_ROOT.rglob("*") if p.is_file()]:
+        done_path = done_root / path.relative_to(OLD_SEARCH_ROOT)
+        done_path.parent.mkdir(exist_ok=True, parents=True)
+        path.rename(done_path)
+    shutil.rmtree(OLD_SEARCH_ROOT)
+    logger.info("migrated old search results", records=n, moved_to=done_root)
+    return n
+
+
+def dump_last_get_nonclicked(
+    last_n=1,
+    workers: Optional[int] = None,
+    chunk_rows=EXPORT_CHUNK,
+    counter: Optional[Counter] = None,
+):
     logger.info("getting non-clicked listings")
-    search_df = get_search_df(last_n)
-    logger.info(f"extending search table with {search_df.shape[0]} records")
-    search_trepo.extend(search_df)
+    counter = Counter() if counter is None else counter
+    n_search = 0
+    started = time()
+    search_recs = get_search_recs(last_n, workers, counter=counter)
+    for recs in batched(timed_iter(search_recs, counter, "search_load"), chunk_rows):
+        with timed(counter, "search_export_write"):
+            search_trepo.extend(pd.DataFrame(recs).pipe(clean_search_df))
+        n_search += len(recs)
+    logger.info(f"extended search table with {n_search} records")
+    # the pages indexed before are of the runs exported by now,
+    # the ones of the coming run are indexed after this
+    counter["search_pages_pruned"] += get_search_page_index().prune(started)
+
+    status_store = get_listing_status_store()
+    detail_recs = get_detail_recs(last_n, workers)
+    for recs in batched(timed_iter(detail_recs, counter, "detail_load"), chunk_rows):
+        with timed(counter, "detail_export_write"):
+            detail_trepo.extend(
+                pd.DataFrame(recs).assign(
+                    id_last_digit=lambda df: df["id"].astype(str).str[-1]
+                )
+            )
+        with timed(counter, "status_upsert"):
+            status_store.upsert(recs)
+        counter["detail_records"] += len(recs)
 
-    detail_df = pd.DataFrame(get_detail_recs(last_n)).assign(
-        id_last_digit=lambda df: df["id"].astype(str).str[-1]
-    )
-    detail_trepo.extend(detail_df)
-
-    non_clicked = (
-        detail_df.groupby("id")
-        .agg({"number_present": "max", "number_revealed": "max", "listing_gone": "max"})
-        .loc[
-            lambda df: ~df["number_revealed"]
-            & ~df["listing_gone"]
-            & df["number_present"]
-        ]
-        .index
-    )
+    non_clicked = status_store.get_non_clicked()
     logger.info(f"found {len(non_clicked)} non-clicked listings")
     return [f"{url_root}/{i}" for i in non_clicked]
 
 
-def collect(proc_last: bool = True, continue_last=False):
-    non_clicked = dump_last_get_nonclicked() if proc_last else []
+def get_search_page_index():
+    """parsed search pages by content hash, kept until their run is exported"""
+    return SqliteKV(f"{EXPORT_ROOT}/search-page-index.sqlite", "search_pages")
+
+
+def get_listing_status_store():
+    return ListingStatusStore(f"{EXPORT_ROOT}/listing-status.sqlite")
+
+
+def backfill_listing_status(last_n=None, workers: Optional[int] = None):
+    """fills the status store from past runs, without writing the exports"""
+    status_store = get_listing_status_store()
+    for recs in batched(get_detail_recs(last_n, workers), EXPORT_CHUNK):
+        status_store.upsert(recs)
+    logger.info("backfilled listing status", listings=len(status_store))
+
+
+@collect_lock()
+def collect(proc_last: bool = True, continue_last=False, tabs: int = 1):
+    metrics = RunMetrics("webext")
+    with metrics.timed("export"):
+        metrics.counter["old_search_migrated"] += migrate_old_search_results()
+        non_clicked = (
+            dump_last_get_nonclicked(counter=metrics.counter) if proc_last else []
+        )
     _wm_ws(6)
     proc_one = Popen(["google-chrome"])
     sleep(3)
     _wm_ws(7)
-    proc_search = Popen(["./chrome-looper.sh", "240", "5"])
-    sleep(10)
-    if continue_last:
-        project.continue_run(force_sync=True)
-    else:
-        project.depot.current.purge()
-        project.run(urls_to_overwrite={WH: init_urls}, force_sync=True)
+    procs_search = _start_loopers(tabs)
+    with metrics.timed("search_run"):
+        if continue_last:
+            run_webext(tabs, counter=metrics.counter)
+        else:
+            project.depot.current.purge()
+            run_webext(
+                tabs,
+                new_run=True,
+                counter=metrics.counter,
+                urls_to_overwrite={WH: init_urls},
+            )
 
     proc_one.kill()
-    proc_search.kill()
+    _stop_loopers(procs_search)
     sleep(4)
     if continue_last:
+        metrics.emit()
         return
 
     _wm_ws(6)
     proc_two = Popen(["google-chrome"])
     sleep(3)
     _wm_ws(7)
-    proc_details = Popen(["./chrome-looper.sh", "240", "5"])
-    sleep(10)
+    procs_details = _start_loopers(tabs)
 
-    rentals = run_details(non_clicked)
+    with metrics.timed("detail_run"):
+        rentals = run_details(non_clicked, tabs, metrics.counter)
     logger.info(f"commiting run of {len(rentals)} new listings")
-    project.commit_current_run()
+    with metrics.timed("commit"):
+        project.commit_current_run()
     logger.info("commited, killing chromes")
 
-    proc_details.kill()
+    _stop_loopers(procs_details)
     sleep(3)
     proc_two.kill()
-    Path("report.md").write_text(
-        "\n- ".join(
-            [
-                date.today().isoformat(),
-                f"collected {len(rentals)} rentals",
-                f"tried non clicked {len(non_clicked)}",
-            ]
-        )
+    # no rate metrics, the pages are paced by the chrome extension
+    metrics.add_peak_rss("main", get_peak_rss())
+    metrics.emit(
+        [
+            f"- collected {len(rentals)} rentals",
+            f"- tried non clicked {len(non_clicked)}",
+        ]
     )
     _wm_ws(0)
     assert len(rentals) > 9_000
 
 
+def _start_loopers(n: int) -> list[Popen]:
+    # with more than one, every looper runs its own chrome as a worker
+    worker_args = [[]] if n == 1 else [[str(i)] for i in range(n)]
+    procs = [
+        Popen(["./chrome-looper.sh", "240", "5", *args], start_new_session=True)
+        for args in worker_args
+    ]
+    sleep(10)
+    return procs
+
+
+def _stop_loopers(procs: list[Popen]):
+    # the chromes of the workers are stopped with their loopers
+    for proc in procs:
+        os.killpg(proc.pid, signal.SIGKILL)
+
+
 def _wm_ws(ws: int):
     try:
         Popen(["wmctrl", "-s", str(ws)])
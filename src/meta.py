@@ -112,6 +112,13 @@ class RealEstateRecord(dz.AbstractEntity):
     area_size = str
     room_count = str
     balcony_size = str
+    price_huf = float
+    price_unit = str
+    area_sqm = float
+    balcony_sqm = float
+    full_rooms = float
+    half_rooms = float
+    photos = float
 
 
 class UtilityCost(dz.AbstractEntity):
@@ -142,3 +149,109 @@ class Parking(dz.AbstractEntity):
 class Label(dz.AbstractEntity):
     property_id = dz.Index & RealEstate
     label = dz.Index & str
+
+
+# compact in-memory dtypes applied to the parsed frames by apply_dtype_plan,
+# the tables are still written with the types declared above
+FLAG = "flag"
+ENUM = "enum"
+SMALL_INT = "small_int"
+SMALL_FLOAT = "small_float"
+
+_INTERVALS = ["interval_y", "interval_m", "interval_d"]
+
+DTYPE_PLANS = {
+    Seller: {
+        Seller.hide_contact_form: FLAG,
+        Seller.realtors_prohibited: FLAG,
+    },
+    Location: {
+        Location.type: ENUM,
+        Location.is_office_building: FLAG,
+        Location.usable_in_ad: FLAG,
+    },
+    RealEstate: {
+        **{
+            c: FLAG
+            for c in [
+                RealEstate.has_air_conditioner,
+                RealEstate.has_barrier_free_access,
+                RealEstate.has_elevator,
+                RealEstate.has_equipments,
+                RealEstate.has_garden_access,
+                RealEstate.has_basement,
+                RealEstate.is_pets_allowed,
+                RealEstate.is_smoking_allowed,
+                RealEstate.participated_in_the_panel_program,
+                RealEstate.is_unincorporated_area,
+                RealEstate.is_bank_claim_offer,
+                RealEstate.is_rental_right_offer,
+                RealEstate.is_outdated,
+                RealEstate.is_active,
+            ]
+        },
+        **{
+            c: ENUM
+            for c in [
+                RealEstate.offer_type,
+                RealEstate.attic_type,
+                RealEstate.bathroom_toilet_separation,
+                RealEstate.building_floor_count,
+                RealEstate.comfort_level,
+                RealEstate.condition,
+                RealEstate.energy_efficiency_rating,
+                RealEstate.without_gas_connection,
+                RealEstate.energy_efficient,
+                RealEstate.is_deleted,
+                RealEstate.floor,
+                RealEstate.furnishment,
+                RealEstate.orientation,
+                RealEstate.solar_panel,
+                RealEstate.subtype,
+                RealEstate.type,
+                RealEstate.insulation,
+                RealEstate.view,
+            ]
+        },
+        **{
+            c: SMALL_INT
+            for c in [
+                RealEstate.room_count,
+                RealEstate.small_room_count,
+                RealEstate.year_of_construction,
+                RealEstate.minimum_rental_period_month,
+                RealEstate.photo_count,
+            ]
+        },
+        **{
+            c: SMALL_FLOAT
+            for c in [
+                RealEstate.area_size,
+                RealEstate.balcony_size,
+                RealEstate.garden_size,
+                RealEstate.lot_size,
+            ]
+        },
+    },
+    Price: {Price.amount: SMALL_INT, **{c: SMALL_INT for c in _INTERVALS}},
+    UtilityCost: {
+        UtilityCost.currency: ENUM,
+        UtilityCost.amount: SMALL_INT,
+        **{c: SMALL_INT for c in _INTERVALS},
+    },
+    Parking: {
+        Parking.type: ENUM,
+        Parking.condition: ENUM,
+        Parking.currency: ENUM,
+        Parking.amount: SMALL_FLOAT,
+        **{c: SMALL_INT for c in _INTERVALS},
+    },
+    RealEstateRecord: {
+        RealEstateRecord.price_unit: ENUM,
+        RealEstateRecord.photos: SMALL_INT,
+        RealEstateRecord.full_rooms: SMALL_INT,
+        RealEstateRecord.half_rooms: SMALL_INT,
+        RealEstateRecord.area_sqm: SMALL_FLOAT,
+        RealEstateRecord.balcony_sqm: SMALL_FLOAT,
+    },
+}
@@ -0,0 +1,144 @@
+import json
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Iterable, Optional, Union
+
+from structlog import get_logger
+
+logger = get_logger(ctx="metrics")
+
+METRICS_DIR = "metrics"
+REPORT_PATH = "report.md"
+SECONDS_SUFFIX = "_seconds"
+
+
+@contextmanager
+def timed(counter: Counter, stage: str):
+    """adds the time spent in the block to <stage>_seconds of the counter"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        counter[stage + SECONDS_SUFFIX] += time.perf_counter() - start
+
+
+def timed_iter(iterable: Iterable, counter: Counter, stage: str):
+    """yields the elements, timing how long getting each one takes"""
+    it = iter(iterable)
+    while True:
+        with timed(counter, stage):
+            try:
+                elem = next(it)
+            except StopIteration:
+                return
+        yield elem
+
+
+class RunMetrics:
+    """stage timings, counts and peak memory of a run
+
+    timings are the <stage>_seconds keys of the counters merged in,
+    the way the parsers, the writer and the rate controllers keep them,
+    everything else is a count. emit logs the metrics, dumps them as
+    json and writes a summary section of the run into report.md
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = datetime.now()
+        self.counter = Counter()
+        self.peak_rss: dict[str, float] = {}
+        self.extra: dict = {}
+        self._start = time.perf_counter()
+
+    def timed(self, stage: str):
+        return timed(self.counter, stage)
+
+    def update(self, counter: Counter, prefix: str = ""):
+        self.counter.update({f"{prefix}{k}": v for k, v in counter.items()})
+
+    def add_peak_rss(self, worker: str, rss: float):
+        self.peak_rss[worker] = max(self.peak_rss.get(worker, 0), rss)
+
+    def to_dict(self) -> dict:
+        wall = time.perf_counter() - self._start
+        stages = {
+            k[: -len(SECONDS_SUFFIX)]: round(v, 3)
+            for k, v in self.counter.items()
+            if k.endswith(SECONDS_SUFFIX)
+        }
+        counts = {
+            k: v for k, v in self.counter.items() if not k.endswith(SECONDS_SUFFIX)
+        }
+        return {
+            "name": self.name,
+            "started": self.started.isoformat(timespec="seconds"),
+            "wall_seconds": round(wall, 3),
+            "stages": stages,
+            "counts": counts,
+            "throughput": {
+                f"{k}_per_second": round(v / wall, 3)
+                for k, v in counts.items()
+                if k.split(":")[-1] in ("pages", "records") and wall
+            },
+            "peak_rss_mb": {k: round(v / 10**6, 1) for k, v in self.peak_rss.items()},
+            **self.extra,
+        }
+
+    def emit(
+        self,
+        lines: Iterable[str] = (),
+        metrics_dir: Union[str, Path] = METRICS_DIR,
+        report_path: Optional[Union[str, Path]] = REPORT_PATH,
+    ) -> dict:
+        out = self.to_dict()
+        logger.info("run metrics", **out)
+        path = Path(metrics_dir, f"{self.name}-{self.started:%Y%m%d-%H%M%S}.json")
+        path.parent.mkdir(exist_ok=True, parents=True)
+        path.write_text(json.dumps(out, indent=2, default=str))
+        if report_path is not None:
+            write_report_section(report_path, self.name, [*lines, *get_summary(out)])
+        return out
+
+
+def get_summary(metrics: dict) -> list[str]:
+    """markdown lines of a metrics dict, stages by time spent
+
+    the seconds of stages run in parallel workers are summed
+    over the workers, so their share can go above 100%
+    """
+    wall = metrics["wall_seconds"] or 1
+    stages = sorted(metrics["stages"].items(), key=lambda kv: -kv[1])
+    return [
+        f"- wall time {metrics['wall_seconds']:.1f}s",
+        *(f"- {k}: {v:,}" for k, v in metrics["counts"].items()),
+        *(f"- {k}: {v:,}" for k, v in metrics["throughput"].items()),
+        *(f"- peak rss of {k}: {v:,} MB" for k, v in metrics["peak_rss_mb"].items()),
+        "",
+        "| stage | seconds | share of wall time |",
+        "| --- | ---: | ---: |",
+        *(f"| {k} | {v:.2f} | {v / wall:.1%} |" for k, v in stages),
+    ]
+
+
+def write_report_section(path: Union[str, Path], name: str, lines: list[str]):
+    """replaces the section of the run in the report, keeping the others"""
+    path = Path(path)
+    text = path.read_text() if path.exists() else ""
+    sections = dict(_split_sections(text))
+    sections[name] = "\n".join(
+        [f"## {name}", "", datetime.now().date().isoformat(), "", *lines]
+    )
+    path.write_text("\n\n".join(s.strip() for s in sections.values()) + "\n")
+
+
+def _split_sections(text: str):
+    # anything before the first section is from before
+    # the report had sections and is dropped
+    for section in re.split(r"\n(?=## )", text):
+        if section.startswith("## "):
+            yield section.split("\n", 1)[0][3:].strip(), section
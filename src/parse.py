@@ -1,5 +1,11 @@
+import html
+import json
 import re
+import zlib
+from collections import Counter
 from datetime import datetime
+from html.entities import html5 as HTML5_ENTITIES
+from typing import Callable, Iterable, Iterator, Optional, Union
 
 import aswan
 import pandas as pd
@@ -17,6 +23,174 @@ from .meta import (
     Seller,
     UtilityCost,
 )
+from .metrics import timed
+
+LISTING_ATTS = ("data-listing", "data-location-hierarchy")
+MAX_TAG_BACKTRACK = 50
+
+_LISTING_ID = re.compile(rb"""\sid\s*=\s*(["']?)listing\1[\s/>]""")
+_ATT = rb"""[^\s"'>/=]+(?:\s*=\s*(?:"[^"]*"|'[^']*'|[^\s"'=<>`]+))?"""
+_START_TAG = re.compile(rb"<[a-zA-Z][^\s/>]*((?:\s+" + _ATT + rb")*)\s*/?>")
+_ATT_KV = re.compile(
+    rb"""([^\s"'>/=]+)(?:\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'=<>`]+)))?"""
+)
+# same as the one html.unescape uses
+_CHARREF = re.compile(r"&(#[0-9]+;?|#[xX][0-9a-fA-F]+;?|[^\t\n\f <&#;]{1,32};?)")
+
+
+def extract_listing_payloads(
+    content: Union[bytes, str], counter: Optional[Counter] = None
+) -> tuple[dict, dict]:
+    """decoded data-listing and data-location-hierarchy of the #listing element
+
+    scans the raw bytes for the start tag and only falls back
+    to building an html5lib tree if that fails
+    """
+    counter = Counter() if counter is None else counter
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    try:
+        with timed(counter, "html_parse"):
+            atts = _scan_listing_atts(content)
+        with timed(counter, "json_decode"):
+            out = tuple(json.loads(atts[k]) for k in LISTING_ATTS)
+        counter["fast_path"] += 1
+        return out
+    except (TypeError, KeyError, ValueError):
+        counter["fallback"] += 1
+    with timed(counter, "html_parse"):
+        elem = BeautifulSoup(content, "html5lib").select_one("#listing")
+    with timed(counter, "json_decode"):
+        return tuple(json.loads(elem.get(k)) for k in LISTING_ATTS)
+
+
+def _scan_listing_atts(content: bytes) -> Optional[dict]:
+    id_match = _LISTING_ID.search(content)
+    if id_match is None:
+        return None
+    start = id_match.start()
+    for _ in range(MAX_TAG_BACKTRACK):
+        start = content.rfind(b"<", 0, start)
+        if start == -1:
+            return None
+        tag_match = _START_TAG.match(content, start)
+        if (tag_match is None) or (tag_match.end() <= id_match.start()):
+            continue
+        atts = {
+            k.decode().lower(): unescape_att(b"".join(vs).decode("utf-8"))
+            for k, *vs in _ATT_KV.findall(tag_match.group(1))
+        }
+        if atts.get("id") == "listing":
+            return atts
+
+
+def unescape_att(s: str) -> str:
+    """html.unescape, but with the html5 rule for attribute values
+
+    a named reference without the ; is left as it is if it is
+    followed by = or an alphanumeric, like &region=2 in a url
+    """
+    if "&" not in s:
+        return s
+    return _CHARREF.sub(_replace_att_charref, s)
+
+
+def _replace_att_charref(m: re.Match) -> str:
+    ref = m.group(1)
+    if ref.startswith("#") or ref.endswith(";"):
+        return html.unescape(m.group())
+    for x in range(len(ref), 1, -1):
+        if ref[:x] in HTML5_ENTITIES:
+            after = ref[x : x + 1]
+            if (after == "=") or (after.isascii() and after.isalnum()):
+                break
+            return HTML5_ENTITIES[ref[:x]] + ref[x:]
+    return m.group()
+
+
+def expand_dicts(s: pd.Series, row_dtype=None) -> pd.DataFrame:
+    """columnar equivalent of s.apply(pd.Series)
+
+    builds the frame from the records at once instead of one
+    Series per row, falls back to the row-wise way if there are
+    elements that are neither dicts nor None
+    """
+    recs = s.tolist()
+    if not all(isinstance(rec, dict) or (rec is None) for rec in recs):
+        return expand_rows(s, row_dtype)
+    return pd.DataFrame([rec or {} for rec in recs], index=s.index)
+
+
+def expand_rows(s: pd.Series, row_dtype=None) -> pd.DataFrame:
+    """s.apply(pd.Series), one Series per row"""
+    return s.apply(lambda _s: pd.Series(_s, dtype=row_dtype))
+
+
+CARD_CLASSES = {b"listing", b"listing-card"}
+LISTING_CARD_COLS = [
+    RealEstateRecord.property_id.id,
+    RealEstateRecord.photo_count,
+    RealEstateRecord.price,
+    RealEstateRecord.address,
+    RealEstateRecord.area_size,
+    RealEstateRecord.room_count,
+    RealEstateRecord.balcony_size,
+]
+HU_MULTIPLIERS = {"ezer": 1e3, "millió": 1e6, "M": 1e6, "milliárd": 1e9, "mrd": 1e9}
+CARD_PACK_MAGIC = b"ING-CARDS-Z1\n"
+
+_AD_HREF = re.compile(rb"""<a\s[^>]*?href\s*=\s*["']?/(\d[^"'\s>]*)""", re.I)
+_AD_ID = re.compile(r"\d*")
+# thousands are separated by (non-breaking) spaces
+_SPACES = "\\s\u00a0\u202f"
+# what follows the number and its multiplier, like Ft/hó or €
+_PRICE_UNIT = rf"^[^\d]*\d[\d{_SPACES},.]*(?:(?:ezer|millió|milliárd|mrd|M)\b)?(.*)$"
+_CLASSED_TAG = re.compile(
+    rb"""<([a-zA-Z][\w-]*)\s[^>]*?class\s*=\s*["']([^"']*)["'][^>]*>"""
+)
+
+
+def scan_ad_links(content: bytes) -> list[str]:
+    """hrefs of links pointing to /<ad id>, without the leading slash"""
+    return [m.decode() for m in _AD_HREF.findall(content)]
+
+
+def get_ad_id(href: str) -> str:
+    """the ad id from a /<ad id>?<params> href or card id"""
+    return _AD_ID.match(href.lstrip("/")).group()
+
+
+def iter_card_fragments(content: bytes) -> Iterator[bytes]:
+    """outer html of .listing and .listing-card elements"""
+    pos = 0
+    while tag_match := _CLASSED_TAG.search(content, pos):
+        if CARD_CLASSES.isdisjoint(tag_match.group(2).split()):
+            pos = tag_match.end()
+            continue
+        end = _find_closing(content, tag_match.group(1), tag_match.end())
+        yield content[tag_match.start() : end]
+        pos = end
+
+
+def pack_listing_cards(content: bytes) -> bytes:
+    """compressed card fragments, all parse_listing needs from a page"""
+    return CARD_PACK_MAGIC + zlib.compress(b"\n".join(iter_card_fragments(content)))
+
+
+def unpack_listing_content(content: Union[bytes, str]) -> Union[bytes, str]:
+    if isinstance(content, bytes) and content.startswith(CARD_PACK_MAGIC):
+        return zlib.decompress(content[len(CARD_PACK_MAGIC) :]).decode("utf-8")
+    return content
+
+
+def _find_closing(content: bytes, tag: bytes, start: int) -> int:
+    depth = 1
+    tag_re = re.compile(rb"<(/?)" + re.escape(tag) + rb"[\s>/]", re.I)
+    for m in tag_re.finditer(content, start):
+        depth += -1 if m.group(1) else 1
+        if depth == 0:
+            return content.find(b">", m.end() - 1) + 1
+    return len(content)
 
 
 def parse_property(df: pd.DataFrame) -> pd.DataFrame:
@@ -27,7 +201,7 @@ def parse_property(df: pd.DataFrame) -> pd.DataFrame:
         .drop(columns="minimumRentalPeriodMonth")
         .pipe(
             lambda _df: pd.concat(
-                [_df.drop(columns="property"), _df["property"].apply(pd.Series)], axis=1
+                [_df.drop(columns="property"), expand_dicts(_df["property"])], axis=1
             )
         )
         .rename(_camel_to_snake, axis=1)
@@ -51,7 +225,7 @@ def parse_location(df: pd.DataFrame):
     return (
         df["locations"]
         .explode()
-        .apply(pd.Series)
+        .pipe(expand_dicts)
         .rename(_camel_to_snake, axis=1)
         .drop_duplicates(Location.id)
         .set_index(Location.id)
@@ -61,15 +235,17 @@ def parse_location(df: pd.DataFrame):
 def parse_seller(df: pd.DataFrame):
     return (
         df["seller"]
-        .apply(pd.Series)
+        .pipe(expand_dicts)
         .rename(_camel_to_snake, axis=1)
         .assign(
             **{
-                Seller.agency: lambda _df: _df["office"].apply(
-                    lambda dic: dic["name"] if not pd.isna(dic) else None
+                Seller.agency: lambda _df: (
+                    _df["office"].apply(
+                        lambda dic: dic["name"] if not pd.isna(dic) else None
+                    )
+                    if "office" in _df.columns
+                    else None
                 )
-                if "office" in _df.columns
-                else None
             }
         )
         .drop(columns=["photo_url", "project_logo_url", "office"], errors="ignore")
@@ -82,7 +258,7 @@ def parse_label(df: pd.DataFrame):
         df["labels"]
         .explode()
         .dropna()
-        .apply(pd.Series)
+        .pipe(expand_dicts)
         .drop(columns=["slug"])
         .reset_index()
         .rename(columns={RealEstate.id: Label.property_id.id, "name": Label.label})
@@ -94,33 +270,37 @@ def parse_parking(df: pd.DataFrame):
     return (
         df["parking"]
         .dropna()
-        .apply(pd.Series)
+        .pipe(expand_dicts)
         .pipe(
-            lambda _df: pd.concat(
-                [
-                    _df.drop(columns="price"),
-                    _df["price"].apply(lambda _s: pd.Series(_s, dtype="object")),
-                ],
-                axis=1,
+            lambda _df: (
+                pd.concat(
+                    [
+                        _df.drop(columns="price"),
+                        expand_dicts(_df["price"], row_dtype="object"),
+                    ],
+                    axis=1,
+                )
+                if "price" in _df.columns
+                else _df
             )
-            if "price" in _df.columns
-            else _df
         )
         .pipe(
-            lambda _df: pd.concat(
-                [
-                    _df.drop(columns="interval"),
-                    (
-                        _df["interval"]
-                        .apply(pd.Series)
-                        .dropna(how="all", axis=1)
-                        .add_prefix("interval_")
-                    ),
-                ],
-                axis=1,
+            lambda _df: (
+                pd.concat(
+                    [
+                        _df.drop(columns="interval"),
+                        (
+                            _df["interval"]
+                            .pipe(expand_dicts)
+                            .dropna(how="all", axis=1)
+                            .add_prefix("interval_")
+                        ),
+                    ],
+                    axis=1,
+                )
+                if "interval" in _df.columns
+                else _df
             )
-            if "interval" in _df.columns
-            else _df
         )
         .rename_axis(index=Parking.property_id.id)
     )
@@ -147,17 +327,19 @@ def parse_utility_cost(df: pd.DataFrame):
     return (
         df["utility_costs"]
         .dropna()
-        .apply(pd.Series)
+        .pipe(expand_dicts)
         .pipe(
-            lambda _df: pd.concat(
-                [
-                    _df.drop(columns="interval"),
-                    _df["interval"].apply(pd.Series).add_prefix("interval_"),
-                ],
-                axis=1,
+            lambda _df: (
+                pd.concat(
+                    [
+                        _df.drop(columns="interval"),
+                        expand_dicts(_df["interval"]).add_prefix("interval_"),
+                    ],
+                    axis=1,
+                )
+                if "interval" in _df.columns
+                else _df
             )
-            if "interval" in _df.columns
-            else _df
         )
         .rename_axis(index=UtilityCost.property_id.id)
     )
@@ -168,17 +350,19 @@ def parse_price(df: pd.DataFrame):
         df["prices"]
         .explode()
         .dropna()
-        .apply(pd.Series)
+        .pipe(expand_dicts)
         .pipe(
-            lambda _df: pd.concat(
-                [
-                    _df.drop(columns="interval"),
-                    _df["interval"].apply(pd.Series).add_prefix("interval_"),
-                ],
-                axis=1,
+            lambda _df: (
+                pd.concat(
+                    [
+                        _df.drop(columns="interval"),
+                        expand_dicts(_df["interval"]).add_prefix("interval_"),
+                    ],
+                    axis=1,
+                )
+                if "interval" in _df.columns
+                else _df
             )
-            if "interval" in _df.columns
-            else _df
         )
         .reset_index()
         .rename(columns={RealEstate.id: Price.property_id.id})
@@ -189,7 +373,7 @@ def parse_price(df: pd.DataFrame):
 def parse_contact(df: pd.DataFrame):
     return (
         df["contact_phone_numbers"]
-        .apply(pd.Series)["numbers"]
+        .pipe(expand_dicts)["numbers"]
         .explode()
         .dropna()
         .to_frame()
@@ -214,20 +398,109 @@ def parse_listing_ad_id(card: "BeautifulSoup"):
 
 
 def parse_listing(pcev: aswan.ParsedCollectionEvent):
-    cont = pcev.content
-    if not isinstance(cont, (bytes, str)):
+    return parse_listings([pcev])
+
+
+def parse_listings(
+    pcevs: Iterable[aswan.ParsedCollectionEvent], counter: Optional[Counter] = None
+) -> pd.DataFrame:
+    """records of all the cards of listing pages, with the typed columns
+
+    the cards are collected into column lists and turned
+    into a single frame at the end
+    """
+    counter = Counter() if counter is None else counter
+    cols = {c: [] for c in LISTING_CARD_COLS}
+    recorded = []
+    for pcev in pcevs:
+        cont = pcev.content
+        counter["pages"] += 1
+        if not isinstance(cont, (bytes, str)):
+            counter["failures"] += 1
+            continue
+        with timed(counter, "html_parse"):
+            cards = parse_cards(cont)
+        for c, values in cols.items():
+            values.extend(card[c] for card in cards)
+        recorded.extend([datetime.fromtimestamp(pcev.cev.timestamp)] * len(cards))
+    counter["records"] += len(recorded)
+    if not recorded:
         return pd.DataFrame()
-    soup = BeautifulSoup(cont, "html5lib")
+    with timed(counter, "flatten"):
+        return (
+            pd.DataFrame(cols)
+            .assign(**{RealEstateRecord.recorded: recorded})
+            .pipe(add_listing_numbers)
+        )
+
+
+def add_listing_numbers(df: pd.DataFrame) -> pd.DataFrame:
+    """typed columns parsed from the display strings of the cards"""
+    raw = df.reindex(LISTING_CARD_COLS, axis=1)
+    price_unit = _on_uniques(
+        raw[RealEstateRecord.price],
+        lambda u: u.str.extract(_PRICE_UNIT)[0].str.strip().astype(object),
+    )
+    return df.assign(
+        **{
+            RealEstateRecord.price_huf: parse_hu_number(
+                raw[RealEstateRecord.price]
+            ).where(price_unit.str.startswith("Ft", na=False)),
+            RealEstateRecord.price_unit: price_unit.where(price_unit.notna(), None),
+            RealEstateRecord.area_sqm: parse_hu_number(raw[RealEstateRecord.area_size]),
+            RealEstateRecord.balcony_sqm: parse_hu_number(
+                raw[RealEstateRecord.balcony_size]
+            ),
+            RealEstateRecord.full_rooms: _on_uniques(
+                raw[RealEstateRecord.room_count],
+                lambda u: _parse_numbers(u.str.extract(r"^\s*(\d+)\s*(?:\+|$)")[0]),
+            ),
+            RealEstateRecord.half_rooms: _on_uniques(
+                raw[RealEstateRecord.room_count],
+                lambda u: _parse_numbers(u.str.extract(r"(\d+)\s*fél")[0]),
+            ),
+            RealEstateRecord.photos: parse_hu_number(raw[RealEstateRecord.photo_count]),
+        }
+    )
+
+
+def parse_hu_number(s: pd.Series) -> pd.Series:
+    """numbers from display strings like 1 234,5 m² or 1,2 millió Ft/hó"""
+    return _on_uniques(s, _parse_numbers)
+
+
+def _on_uniques(s: pd.Series, fun: Callable) -> pd.Series:
+    # display strings repeat a lot, so only the distinct ones are parsed
+    codes = s.astype("category").cat
+    out = fun(codes.categories.to_series().astype("string"))
+    return out.reset_index(drop=True).reindex(codes.codes).set_axis(s.index)
+
+
+def _parse_numbers(uniques: pd.Series) -> pd.Series:
+    number = (
+        uniques.str.extract(rf"(\d[\d{_SPACES}]*(?:,\d+)?)")[0]
+        .str.replace(f"[{_SPACES}]", "", regex=True)
+        .str.replace(",", ".")
+    )
+    multiplier = (
+        uniques.str.extract(r"\d\s*(ezer|millió|M|milliárd|mrd)\b")[0]
+        .map(HU_MULTIPLIERS)
+        .astype(float)
+        .fillna(1)
+    )
+    return pd.to_numeric(number, errors="coerce").astype(float) * multiplier
+
+
+def parse_cards(content: Union[bytes, str]) -> list[dict]:
+    soup = BeautifulSoup(unpack_listing_content(content), "html5lib")
     recs = []
     for c, fun in [(".listing", old_card_parser), (".listing-card", new_card_parser)]:
         recs.extend(map(fun, soup.select(c)))
-    return pd.DataFrame(recs).assign(
-        **{RealEstateRecord.recorded: datetime.fromtimestamp(pcev.cev.timestamp)}
-    )
+    return recs
 
 
 def get_by_word(card, word):
-    wspan = card.find("span", text=word)
+    wspan = card.find("span", string=word)
     if wspan is not None:
         return getattr(wspan.find_next("span"), "text", "").strip()
 
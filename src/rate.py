@@ -0,0 +1,266 @@
+import json
+import os
+import random
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import Counter
+from pathlib import Path
+from typing import Optional, Union
+
+from structlog import get_logger
+
+logger = get_logger(ctx="rate")
+
+THROTTLE_CODES = {403, 408, 429, 500, 502, 503, 504}
+OK_CODES = {404, 410}
+
+
+class RateController(ABC):
+    """decides how long a handler waits between requests
+
+    subclass and set as rate_controller_cls on a RateControlledMixin handler
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.metrics = Counter()
+        self.failures = 0
+        self._started: Optional[float] = None
+
+    @abstractmethod
+    def get_delay(self) -> float:
+        """seconds to wait before the next request"""
+
+    @abstractmethod
+    def get_backoff(self) -> float:
+        """seconds to wait before restarting a session after failures"""
+
+    def on_success(self, latency: float):
+        pass
+
+    def on_failure(self, result: Union[int, Exception]):
+        pass
+
+    def request_started(self):
+        self._started = time.monotonic()
+        self.metrics["requests"] += 1
+
+    def request_succeeded(self):
+        latency = time.monotonic() - (self._started or time.monotonic())
+        self.metrics["successes"] += 1
+        self.metrics["latency_sum"] += latency
+        self.failures = 0
+        self.on_success(latency)
+
+    def request_failed(self, result: Union[int, Exception]):
+        if isinstance(result, int):
+            self.metrics[f"status_{result}"] += 1
+        else:
+            self.metrics[type(result).__name__] += 1
+        if isinstance(result, int) and result in OK_CODES:
+            return
+        if _is_throttled(result):
+            self.metrics["throttled"] += 1
+        self.failures += 1
+        self.on_failure(result)
+
+    def sleep(self, seconds: float, kind: str):
+        self.metrics[f"{kind}_seconds"] += seconds
+        time.sleep(seconds)
+
+    def get_metrics(self) -> dict:
+        n_ok = self.metrics["successes"]
+        return dict(self.metrics) | {
+            "handler": self.name,
+            "mean_latency": self.metrics["latency_sum"] / n_ok if n_ok else None,
+        }
+
+
+class AimdRateController(RateController):
+    """additive increase, multiplicative decrease of the request rate
+
+    the rate grows by a fixed step after every fast success and is
+    cut on throttling responses or latency spikes, consecutive
+    failures back off exponentially with jitter
+    """
+
+    def __init__(
+        self,
+        name: str,
+        initial_delay: float = 2,
+        min_delay: float = 0.5,
+        max_delay: float = 30,
+        rate_step: float = 0.02,
+        decrease_factor: float = 0.5,
+        slow_latency_factor: float = 3,
+        backoff_base: float = 5,
+        backoff_cap: float = 300,
+        log_every: int = 200,
+    ):
+        super().__init__(name)
+        self.min_rate = 1 / max_delay
+        self.max_rate = 1 / min_delay
+        self.rate = 1 / initial_delay
+        self.rate_step = rate_step
+        self.decrease_factor = decrease_factor
+        self.slow_latency_factor = slow_latency_factor
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.log_every = log_every
+        self._latency_ewma: Optional[float] = None
+
+    def get_delay(self) -> float:
+        delay = 1 / self.rate
+        return delay * random.uniform(0.9, 1.1)
+
+    def get_backoff(self) -> float:
+        cap = min(self.backoff_cap, self.backoff_base * 2**self.failures)
+        self.metrics["backoffs"] += 1
+        return cap / 2 + random.uniform(0, cap / 2)
+
+    def on_success(self, latency: float):
+        if self._is_slow(latency):
+            self.metrics["slow"] += 1
+            self._decrease()
+        else:
+            self.rate = min(self.max_rate, self.rate + self.rate_step)
+        if self.metrics["requests"] % self.log_every == 0:
+            logger.info("rate metrics", **self.get_metrics())
+
+    def on_failure(self, result: Union[int, Exception]):
+        self._decrease()
+        logger.warning(
+            "request failed", handler=self.name, result=str(result), delay=1 / self.rate
+        )
+
+    def get_metrics(self) -> dict:
+        return super().get_metrics() | {"delay": 1 / self.rate}
+
+    def _decrease(self):
+        self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+
+    def _is_slow(self, latency: float) -> bool:
+        ewma = self._latency_ewma
+        self._latency_ewma = latency if ewma is None else 0.9 * ewma + 0.1 * latency
+        return (ewma is not None) and (latency > self.slow_latency_factor * ewma)
+
+
+class RateControlledMixin:
+    """paces an aswan request handler with a per-process rate controller
+
+    the handlers run in the crawl processes, so if get_rate_metrics_dir
+    gives a directory, the metrics of the process are written there
+    after every request for the collecting process to read
+    """
+
+    rate_controller_cls: type[RateController] = AimdRateController
+    rate_controller_kwargs: dict = {}
+
+    def get_rate_metrics_dir(self) -> Optional[Path]:
+        return None
+
+    @property
+    def rate_controller(self) -> RateController:
+        return get_rate_controller(
+            self.name, self.rate_controller_cls, **self.rate_controller_kwargs
+        )
+
+    def get_sleep_time(self):
+        delay = self.rate_controller.get_delay()
+        self.rate_controller.metrics["pacing_seconds"] += delay
+        return delay
+
+    def handle_driver(self, session):
+        self.rate_controller.request_started()
+        return super().handle_driver(session)
+
+    def pre_parse(self, blob):
+        self.rate_controller.request_succeeded()
+        self._dump_rate_metrics()
+        return super().pre_parse(blob)
+
+    def is_session_broken(self, result: Union[int, Exception]):
+        self.rate_controller.request_failed(result)
+        self._dump_rate_metrics()
+        return super().is_session_broken(result)
+
+    def start_session(self, session):
+        controller = self.rate_controller
+        if controller.failures:
+            controller.sleep(controller.get_backoff(), "backoff")
+        return super().start_session(session)
+
+    def _dump_rate_metrics(self):
+        metrics_dir = self.get_rate_metrics_dir()
+        if metrics_dir is not None:
+            dump_rate_metrics(metrics_dir)
+
+
+_CONTROLLERS: dict[str, RateController] = {}
+_PROCESS: dict = {}
+# summed over the processes when read, the rest is recomputed or kept as max
+_MAX_METRICS = {"delay"}
+_DERIVED_METRICS = {"handler", "mean_latency"}
+
+
+def get_rate_controller(name: str, cls=AimdRateController, **kwargs) -> RateController:
+    # handlers are pickled into the collecting processes,
+    # so the controllers live at module level, a forked
+    # process starts counting from scratch
+    if _PROCESS.get("pid") != os.getpid():
+        _CONTROLLERS.clear()
+        _PROCESS.update(pid=os.getpid(), key=uuid.uuid4().hex)
+    if name not in _CONTROLLERS:
+        _CONTROLLERS[name] = cls(name, **kwargs)
+    return _CONTROLLERS[name]
+
+
+def get_rate_metrics() -> dict[str, dict]:
+    return {name: c.get_metrics() for name, c in _CONTROLLERS.items()}
+
+
+def dump_rate_metrics(metrics_dir: Union[str, Path]):
+    """overwrites the metrics file of this process"""
+    if not _CONTROLLERS:
+        return
+    path = Path(metrics_dir, f"{_PROCESS['pid']}-{_PROCESS['key']}.json")
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    tmp_path.write_text(json.dumps(get_rate_metrics()))
+    os.replace(tmp_path, path)
+
+
+def read_rate_metrics(metrics_dir: Union[str, Path], consume: bool = True) -> dict:
+    """merges the metrics the crawl processes dumped, per handler
+
+    with consume, the files read are removed, so the next run only
+    reads the metrics of its own crawl
+    """
+    merged: dict[str, dict] = {}
+    paths = sorted(Path(metrics_dir).glob("*.json"))
+    for path in paths:
+        for name, metrics in json.loads(path.read_text()).items():
+            _merge_metrics(merged.setdefault(name, {"handler": name}), metrics)
+    for metrics in merged.values():
+        n_ok = metrics.get("successes", 0)
+        latency = metrics.get("latency_sum", 0)
+        metrics["mean_latency"] = latency / n_ok if n_ok else None
+    if consume:
+        for path in paths:
+            path.unlink()
+    return merged
+
+
+def _merge_metrics(merged: dict, metrics: dict):
+    for k, v in metrics.items():
+        if (k in _DERIVED_METRICS) or (v is None):
+            continue
+        if k in _MAX_METRICS:
+            merged[k] = max(merged.get(k, v), v)
+        else:
+            merged[k] = merged.get(k, 0) + v
+
+
+def _is_throttled(result: Union[int, Exception]) -> bool:
+    return (not isinstance(result, int)) or (result in THROTTLE_CODES)
@@ -0,0 +1,76 @@
+import time
+from datetime import datetime
+from typing import Iterable, Optional, Union
+
+import datazimmer as dz
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+from structlog import get_logger
+
+from .dtypes import apply_dtype_plan
+
+logger = get_logger(ctx="reader")
+
+# small enough for a point lookup to read little more than it needs
+ROW_GROUP_SIZE = 50_000
+READ_ATTEMPTS = 3
+
+TimeBound = Union[str, datetime, pd.Timestamp, None]
+
+
+def read_filtered(
+    table: "dz.ScruTable",
+    filter: Optional[pc.Expression] = None,
+    columns: Optional[list[str]] = None,
+) -> pd.DataFrame:
+    """rows of a table matching a pyarrow expression
+
+    row groups are skipped if their min/max statistics
+    rule out the filter, so this is cheap on sorted tables
+
+    the frame gets the compact dtypes of the plan of the entity
+
+    a file rewritten while it is read, e.g. swapped by a compaction
+    between reading its footer and its data, fails the read, that is
+    retried with a new listing
+    """
+    for attempt in range(READ_ATTEMPTS):
+        paths = [p.as_posix() for p in table.paths]
+        if not paths:
+            return pd.DataFrame()
+        try:
+            dataset = ds.dataset(paths, format="parquet")
+            df = dataset.to_table(columns=columns, filter=filter).to_pandas()
+            return apply_dtype_plan(df, table.abstract_entity)
+        except (OSError, pa.ArrowInvalid) as e:
+            if attempt == READ_ATTEMPTS - 1:
+                raise e
+            logger.warning("read failed, retrying", table=table.name, e=str(e))
+            time.sleep(0.1 * 2**attempt)
+
+
+def id_filter(col: str, ids: Optional[Iterable]) -> Optional[pc.Expression]:
+    if ids is None:
+        return None
+    return pc.field(col).isin(list(ids))
+
+
+def time_filter(
+    col: str, since: TimeBound = None, until: TimeBound = None
+) -> Optional[pc.Expression]:
+    """since is inclusive, until is exclusive"""
+    exprs = []
+    if since is not None:
+        exprs.append(pc.field(col) >= pd.Timestamp(since).to_pydatetime())
+    if until is not None:
+        exprs.append(pc.field(col) < pd.Timestamp(until).to_pydatetime())
+    return all_of(*exprs)
+
+
+def all_of(*exprs: Optional[pc.Expression]) -> Optional[pc.Expression]:
+    out = None
+    for expr in filter(lambda e: e is not None, exprs):
+        out = expr if out is None else out & expr
+    return out
@@ -0,0 +1,198 @@
+import os
+import resource
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass
+from functools import partial
+from itertools import islice
+from statistics import median
+from typing import Callable, Iterable, Optional
+
+import datazimmer as dz
+import psutil
+from structlog import get_logger
+from tqdm import tqdm
+
+logger = get_logger(ctx="scheduling")
+
+BUDGET_ENV_VAR = "INGATLAN_MEMORY_BUDGET_GB"
+GB = 10**9
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+@dataclass
+class CollectBudget(dz.PersistentState):
+    """limits and settings for the parsing in collect
+
+    set under persistent_states in zimmer.yaml, the memory budget
+    can also be overridden with the INGATLAN_MEMORY_BUDGET_GB env var
+    """
+
+    memory_gb: Optional[float] = None
+    max_workers: Optional[int] = None
+    initial_batch_size: int = 200
+    min_batch_size: int = 20
+    max_batch_size: int = 2000
+    # the settings are planned from the last workers * this many batches
+    batches_per_round: int = 8
+    write_chunk_rows: int = 200_000
+    # keep description and polygon texts in the blob store
+    blob_store: bool = False
+    # compact the tables sorted by their lookup keys after collecting
+    compact_tables: bool = True
+
+    def get_memory_bytes(self) -> float:
+        env_budget = os.environ.get(BUDGET_ENV_VAR)
+        if env_budget:
+            return float(env_budget) * GB
+        if self.memory_gb:
+            return self.memory_gb * GB
+        return psutil.virtual_memory().available * 0.8
+
+    def get_max_workers(self) -> int:
+        return self.max_workers or os.cpu_count() or 1
+
+
+@dataclass
+class BatchStats:
+    size: int
+    seconds: float
+    base_rss: float
+    peak_rss: float
+    worker: int = 0
+
+    @property
+    def rss_per_event(self):
+        return max(self.peak_rss - self.base_rss, 0) / max(self.size, 1)
+
+
+class AdaptiveScheduler:
+    """runs a batch function over an event stream in a process pool
+
+    the pool is kept for the whole stream, a new batch is submitted
+    whenever one finishes, so there are no barriers between batches.
+    the first batches use the initial batch size and a conservative
+    worker count, after that the settings of every submission are
+    planned from the measured rss and wall time of the recent batches
+    """
+
+    def __init__(self, budget: Optional[CollectBudget] = None):
+        self.budget = budget or CollectBudget()
+        self.memory = self.budget.get_memory_bytes()
+        self.max_workers = self.budget.get_max_workers()
+        self.batch_size = self.budget.initial_batch_size
+        self.workers = _clamp(int(self.memory / GB / 2.5), 1, self.max_workers)
+        self.stats: list[BatchStats] = []
+
+    def map(self, fun: Callable, iterable: Iterable, pbar=False, verbose=False):
+        """yields the outputs of fun on the batches, in the order they finish"""
+        it = iter(iterable)
+        measured_fun = partial(run_measured, fun)
+        logger.info(
+            "starting pool",
+            workers=self.workers,
+            max_workers=self.max_workers,
+            batch_size=self.batch_size,
+            memory_budget_gb=round(self.memory / GB, 2),
+        )
+        pool = ProcessPoolExecutor(self.max_workers)
+        running = set()
+        progress = tqdm(unit="batch", disable=not pbar)
+        try:
+            while True:
+                while len(running) < self.workers:
+                    batch = list(islice(it, self.batch_size))
+                    if not batch:
+                        break
+                    running.add(pool.submit(measured_fun, batch))
+                if not running:
+                    break
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    out, stats = future.result()
+                    self.stats.append(stats)
+                    progress.update()
+                    yield out
+                if len(self.stats) >= self.workers:
+                    self.plan(verbose)
+        finally:
+            progress.close()
+            pool.shutdown(cancel_futures=True)
+
+    def plan(self, verbose: bool = False):
+        recent = self.stats[-self.workers * self.budget.batches_per_round :]
+        per_event = max(s.rss_per_event for s in recent) or 1
+        base = median(s.base_rss for s in recent)
+        per_worker = self.memory / self.max_workers
+        settings = (self.workers, self.batch_size)
+        self.batch_size = _clamp(
+            int((per_worker - base) / per_event),
+            self.budget.min_batch_size,
+            self.budget.max_batch_size,
+        )
+        self.workers = _clamp(
+            int(self.memory // (base + per_event * self.batch_size)),
+            1,
+            self.max_workers,
+        )
+        if verbose and (settings != (self.workers, self.batch_size)):
+            logger.info(
+                "planned settings",
+                workers=self.workers,
+                batch_size=self.batch_size,
+                mb_per_event=round(per_event / 10**6, 3),
+                base_mb=round(base / 10**6, 1),
+                sec_per_event=round(
+                    sum(s.seconds for s in recent) / sum(s.size for s in recent), 4
+                ),
+            )
+
+
+def run_measured(fun: Callable, batch: list):
+    # the pool workers run many batches, so the lifetime peak of
+    # the process says nothing of this one
+    window = reset_peak_rss()
+    base_rss = get_current_rss()
+    start = time.perf_counter()
+    out = fun(batch)
+    elapsed = time.perf_counter() - start
+    peak_rss = max(get_window_peak_rss() if window else 0, get_current_rss())
+    return out, BatchStats(len(batch), elapsed, base_rss, peak_rss, os.getpid())
+
+
+def get_current_rss() -> float:
+    try:
+        with open("/proc/self/statm") as fp:
+            return int(fp.read().split()[1]) * PAGE_SIZE
+    except OSError:
+        return psutil.Process().memory_info().rss
+
+
+def reset_peak_rss() -> bool:
+    """restarts the peak rss of the process from its current rss, on linux"""
+    try:
+        with open("/proc/self/clear_refs", "w") as fp:
+            fp.write("5")
+    except OSError:
+        return False
+    return True
+
+
+def get_window_peak_rss() -> float:
+    """peak rss since the last reset_peak_rss, where it can be reset"""
+    try:
+        with open("/proc/self/status") as fp:
+            for line in fp:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def get_peak_rss() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _clamp(value: int, low: int, high: int) -> int:
+    return max(low, min(value, high))
@@ -0,0 +1,269 @@
+import hashlib
+import json
+import sqlite3
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import TYPE_CHECKING, Iterable, Optional, Union
+
+import zstandard
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+MAX_SQL_PARAMS = 500
+BLOB_REF_PREFIX = "zblob:"
+
+
+class SqliteKV:
+    """small persistent key -> value map in one sqlite table
+
+    safe to use from several worker processes, every call
+    opens its own short-lived connection
+    """
+
+    def __init__(self, path: Union[str, Path], table: str = "kv"):
+        self.path = Path(path)
+        self.table = table
+        self.path.parent.mkdir(exist_ok=True, parents=True)
+        with self._connect() as conn:
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} "
+                "(key PRIMARY KEY, value TEXT, updated REAL)"
+            )
+
+    def get_many(self, keys: Iterable, newer_than: Optional[float] = None) -> dict:
+        """values of the keys that are present, set after newer_than if given"""
+        out = {}
+        keys = list(keys)
+        with self._connect() as conn:
+            for i in range(0, len(keys), MAX_SQL_PARAMS):
+                chunk = keys[i : i + MAX_SQL_PARAMS]
+                marks = ",".join("?" * len(chunk))
+                query = f"SELECT key, value FROM {self.table} WHERE key IN ({marks})"
+                if newer_than is not None:
+                    query += " AND updated > ?"
+                    chunk = chunk + [newer_than]
+                out.update(conn.execute(query, chunk).fetchall())
+        return out
+
+    def set_many(self, items: dict):
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                f"INSERT OR REPLACE INTO {self.table} VALUES (?, ?, ?)",
+                [(k, v, now) for k, v in items.items()],
+            )
+
+    def purge(self):
+        with self._connect() as conn:
+            conn.execute(f"DELETE FROM {self.table}")
+
+    def prune(self, older_than: float) -> int:
+        """deletes the keys set before older_than, returns how many"""
+        with self._connect() as conn:
+            query = f"DELETE FROM {self.table} WHERE updated < ?"
+            return conn.execute(query, [older_than]).rowcount
+
+    def __len__(self):
+        with self._connect() as conn:
+            return conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def _connect(self):
+        return _connect(self.path)
+
+
+class ListingStatusStore:
+    """latest known contact status of every webext listing, keyed by id
+
+    the flags only ever turn on, as with taking their max over
+    all detail pages of a listing
+    """
+
+    flags = ["number_present", "number_revealed", "listing_gone"]
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.path.parent.mkdir(exist_ok=True, parents=True)
+        with _connect(self.path) as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS listing_status (id INTEGER PRIMARY KEY, "
+                + ", ".join(f"{f} INTEGER" for f in self.flags)
+                + ", phone_number TEXT, last_collected TEXT)"
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS status_flags ON listing_status "
+                f"({', '.join(self.flags)})"
+            )
+
+    def upsert(self, recs: Iterable[dict]):
+        updates = ", ".join(f"{f} = max({f}, excluded.{f})" for f in self.flags)
+        with _connect(self.path) as conn:
+            conn.executemany(
+                "INSERT INTO listing_status VALUES (?, ?, ?, ?, ?, ?) "
+                f"ON CONFLICT(id) DO UPDATE SET {updates}, "
+                "phone_number = CASE WHEN excluded.number_revealed "
+                "THEN excluded.phone_number ELSE phone_number END, "
+                "last_collected = max(last_collected, excluded.last_collected)",
+                [
+                    (
+                        int(rec["id"]),
+                        *(bool(rec[f]) for f in self.flags),
+                        rec["phone_number"],
+                        rec["collected"],
+                    )
+                    for rec in recs
+                ],
+            )
+
+    def get_ids(self, **flags: bool) -> list[int]:
+        where = " AND ".join(f"{f} = ?" for f in flags) or "1"
+        with _connect(self.path) as conn:
+            return [
+                r[0]
+                for r in conn.execute(
+                    f"SELECT id FROM listing_status WHERE {where} ORDER BY id",
+                    [*map(bool, flags.values())],
+                )
+            ]
+
+    def get_non_clicked(self) -> list[int]:
+        return self.get_ids(
+            number_present=True, number_revealed=False, listing_gone=False
+        )
+
+    def __len__(self):
+        with _connect(self.path) as conn:
+            return conn.execute("SELECT COUNT(*) FROM listing_status").fetchone()[0]
+
+
+class BlobStore:
+    """deduplicated, zstd compressed texts, addressed by their hash
+
+    tables keep a blob_ref in place of the text, resolve reads
+    the texts back only for the refs asked for
+    """
+
+    def __init__(self, path: Union[str, Path], level: int = 10):
+        self.path = Path(path)
+        self.path.parent.mkdir(exist_ok=True, parents=True)
+        self._compressor = zstandard.ZstdCompressor(level=level)
+        self._decompressor = zstandard.ZstdDecompressor()
+        with _connect(self.path) as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS blobs (ref TEXT PRIMARY KEY, data BLOB)"
+            )
+
+    def externalize(self, s: "pd.Series") -> "pd.Series":
+        """the series with its texts stored and replaced by refs"""
+        texts = {
+            t: blob_ref(t)
+            for t in s.dropna().unique()
+            if isinstance(t, str) and not is_blob_ref(t)
+        }
+        with _connect(self.path) as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO blobs VALUES (?, ?)",
+                [
+                    (ref, self._compressor.compress(t.encode("utf-8")))
+                    for t, ref in texts.items()
+                ],
+            )
+        return s.map(lambda t: texts.get(t, t))
+
+    def resolve(self, s: "pd.Series") -> "pd.Series":
+        """the series with its refs replaced by the stored texts"""
+        refs = [r for r in s.dropna().unique() if is_blob_ref(r)]
+        texts = {}
+        with _connect(self.path) as conn:
+            for i in range(0, len(refs), MAX_SQL_PARAMS):
+                chunk = refs[i : i + MAX_SQL_PARAMS]
+                marks = ",".join("?" * len(chunk))
+                for ref, data in conn.execute(
+                    f"SELECT ref, data FROM blobs WHERE ref IN ({marks})", chunk
+                ):
+                    texts[ref] = self._decompressor.decompress(data).decode("utf-8")
+        return s.map(lambda r: texts.get(r, r))
+
+    def __len__(self):
+        with _connect(self.path) as conn:
+            return conn.execute("SELECT COUNT(*) FROM blobs").fetchone()[0]
+
+
+class DriftStore:
+    """values that did not fit the tables, kept as json
+
+    keyed by entity, column and the json of the index of the record,
+    a value seen again is overwritten. once its entity is fixed to
+    take it, it can be backfilled from here without reparsing
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.path.parent.mkdir(exist_ok=True, parents=True)
+        with _connect(self.path) as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS drift (entity TEXT, col TEXT, key TEXT, "
+                "value TEXT, updated REAL, PRIMARY KEY (entity, col, key))"
+            )
+
+    def add(self, recs: Iterable[tuple[str, str, str, str]]):
+        now = time.time()
+        with _connect(self.path) as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO drift VALUES (?, ?, ?, ?, ?)",
+                [(*rec, now) for rec in recs],
+            )
+
+    def get_values(self, entity: str, col: str) -> dict:
+        """record index -> value of a column"""
+        with _connect(self.path) as conn:
+            return {
+                _from_json_key(key): json.loads(value)
+                for key, value in conn.execute(
+                    "SELECT key, value FROM drift WHERE entity = ? AND col = ?",
+                    [entity, col],
+                )
+            }
+
+    def __len__(self):
+        with _connect(self.path) as conn:
+            return conn.execute("SELECT COUNT(*) FROM drift").fetchone()[0]
+
+
+def _from_json_key(key: str):
+    out = json.loads(key)
+    return tuple(out) if isinstance(out, list) else out
+
+
+def blob_ref(text: str) -> str:
+    return BLOB_REF_PREFIX + hash_content(text)
+
+
+def is_blob_ref(value) -> bool:
+    return isinstance(value, str) and value.startswith(BLOB_REF_PREFIX)
+
+
+@contextmanager
+def _connect(path: Path):
+    conn = sqlite3.connect(path, timeout=120)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def hash_content(content: Union[str, bytes]) -> str:
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    return hashlib.blake2b(content, digest_size=16).hexdigest()
+
+
+def hash_payloads(*payloads) -> str:
+    """hash of json payloads that does not depend on key order"""
+    h = hashlib.blake2b(digest_size=16)
+    for payload in payloads:
+        h.update(json.dumps(payload, sort_keys=True, separators=(",", ":")).encode())
+    return h.hexdigest()
@@ -1,6 +1,10 @@
+import os
 import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from typing import TYPE_CHECKING
+from itertools import islice
+from typing import TYPE_CHECKING, Callable, Iterable, Optional
 
 from pytz import timezone
 from structlog import get_logger
@@ -17,20 +21,59 @@ def _get_now() -> datetime:
     return now + timezone("Europe/Budapest").utcoffset(now)
 
 
-class MissingVariable(Exception):
-    "Missing variable from meta config"
+def check_missing_col(
+    df: "pd.DataFrame", table: "dz.ScruTable", ignored: Iterable[str] = ()
+) -> tuple["pd.DataFrame", "pd.DataFrame"]:
+    """the frame with the columns of the table, and the non-empty others
 
-
-def check_missing_col(df: "pd.DataFrame", table: "dz.ScruTable"):
-    remaining_df = df.dropna(axis=1, how="all").drop(
-        columns=table.feature_cols, errors="ignore"
+    columns of the table missing from the frame are added empty,
+    the ignored ones are dropped without being returned
+    """
+    known = [*(c for c in table.index_cols if c in df.columns), *table.feature_cols]
+    unknown = df.dropna(axis=1, how="all").drop(
+        columns=[*known, *ignored], errors="ignore"
     )
-    if remaining_df.empty:
-        return df.reindex(table.feature_cols, axis=1)
-    else:
-        logger.info("Missing variable", cols=remaining_df.columns.tolist())
-        raise MissingVariable()
+    return df.reindex(known, axis=1), unknown
 
 
 def _parse_url(url):
     return int(re.search(r"https://ingatlan.com/(\d+)", url).group(1))
+
+
+def batched(iterable, n):
+    it = iter(iterable)
+    while batch := list(islice(it, n)):
+        yield batch
+
+
+def ordered_pool_map(
+    fun: Callable,
+    iterable: Iterable,
+    workers: Optional[int] = None,
+    chunk_size: int = 16,
+    chunks_per_worker: int = 2,
+):
+    """fun over the iterable in a process pool, yielded in input order
+
+    at most chunks_per_worker chunks per worker are in flight,
+    so the input is only read as fast as the output is consumed
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        yield from map(fun, iterable)
+        return
+    pool = ProcessPoolExecutor(workers)
+    pending = deque()
+    try:
+        for chunk in batched(iterable, chunk_size):
+            pending.append(pool.submit(_map_chunk, fun, chunk))
+            if len(pending) >= workers * chunks_per_worker:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+
+def _map_chunk(fun: Callable, chunk: list) -> list:
+    return [*map(fun, chunk)]
@@ -0,0 +1,119 @@
+from collections import Counter, defaultdict
+from dataclasses import dataclass, field
+from typing import Optional
+
+import datazimmer as dz
+import pandas as pd
+from structlog import get_logger
+
+from .metrics import timed
+from .stores import DriftStore, SqliteKV
+
+logger = get_logger(ctx="writer")
+
+
+@dataclass
+class ParsedBatch:
+    """what a parsing worker hands back instead of writing itself"""
+
+    replace: dict[type, pd.DataFrame] = field(default_factory=dict)
+    extend: dict[type, pd.DataFrame] = field(default_factory=dict)
+    hashes: dict = field(default_factory=dict)
+    dim_hashes: dict = field(default_factory=dict)
+    counter: Counter = field(default_factory=Counter)
+    # (entity, column, key, value) of what did not fit the tables
+    drift: list = field(default_factory=list)
+
+
+class CoalescingWriter:
+    """merges parsed batches per table and writes them in large chunks
+
+    replaced records keep the last-write-wins behavior of calling
+    replace_records batch by batch: a later batch overrides an earlier
+    one, within a batch the first record of an index wins
+
+    hashes of a batch are only committed to the index once
+    its frames are flushed, along with the drift of the batch
+    """
+
+    def __init__(
+        self,
+        tables: dict[type, "dz.ScruTable"],
+        max_rows: int = 200_000,
+        hash_index: Optional[SqliteKV] = None,
+        dim_index: Optional[SqliteKV] = None,
+        drift_store: Optional[DriftStore] = None,
+    ):
+        self.tables = tables
+        self.max_rows = max_rows
+        self.hash_index = hash_index
+        self.dim_index = dim_index
+        self.drift_store = drift_store
+        self.counter = Counter()
+        self.drift_counts = Counter()
+        self._replace = defaultdict(list)
+        self._extend = defaultdict(list)
+        self._hashes = {}
+        self._dim_hashes = {}
+        self._drift = []
+        self._rows = 0
+
+    def add(self, batch: ParsedBatch):
+        for buffer, frames in [
+            (self._replace, batch.replace),
+            (self._extend, batch.extend),
+        ]:
+            for entity, df in frames.items():
+                if df.empty:
+                    continue
+                buffer[entity].append(df)
+                self._rows += df.shape[0]
+        self._hashes.update(batch.hashes)
+        self._dim_hashes.update(batch.dim_hashes)
+        self._drift.extend(batch.drift)
+        self.counter.update(batch.counter)
+        if self._rows >= self.max_rows:
+            self.flush()
+
+    def flush(self):
+        for entity, frames in self._replace.items():
+            df = pd.concat(frames[::-1])
+            df = df.loc[~df.index.duplicated(keep="first"), :]
+            table = self.tables[entity]
+            with timed(self.counter, f"write_{table.name}"):
+                table.replace_records(df, by_groups=bool(table.partitioning_cols))
+            self._log_write(table, "replace", len(frames), df.shape[0])
+        for entity, frames in self._extend.items():
+            df = pd.concat(frames)
+            with timed(self.counter, f"write_{self.tables[entity].name}"):
+                self.tables[entity].extend(df)
+            self._log_write(self.tables[entity], "extend", len(frames), df.shape[0])
+        for index, hashes in [
+            (self.hash_index, self._hashes),
+            (self.dim_index, self._dim_hashes),
+        ]:
+            if index is not None and hashes:
+                with timed(self.counter, "hash_write"):
+                    index.set_many(hashes)
+        if self._drift:
+            self._write_drift()
+        self.counter["flushes"] += 1
+        self._replace = defaultdict(list)
+        self._extend = defaultdict(list)
+        self._hashes = {}
+        self._dim_hashes = {}
+        self._drift = []
+        self._rows = 0
+
+    def _write_drift(self):
+        counts = Counter(f"{entity}.{col}" for entity, col, _, _ in self._drift)
+        logger.warning("schema drift", **counts)
+        self.drift_counts.update(counts)
+        self.counter["drift_values"] += len(self._drift)
+        if self.drift_store is not None:
+            with timed(self.counter, "drift_write"):
+                self.drift_store.add(self._drift)
+
+    def _log_write(self, table, kind, n_frames, n_rows):
+        self.counter[f"{kind}_rows"] += n_rows
+        logger.info("wrote", table=table.name, kind=kind, frames=n_frames, rows=n_rows)
@@ -0,0 +1,5 @@
+import os
+import tempfile
+
+# the webext module reads its export root on import
+os.environ.setdefault("WEBEXT_EXPORT_ROOT", tempfile.mkdtemp())
@@ -0,0 +1,47 @@
+import threading
+
+import pandas as pd
+import pytest
+from atqo import acquire_lock
+from parquetranger import TableRepo
+
+from src import compaction
+from src.compaction import CollectRunning, collect_lock, compact_paths
+
+
+@pytest.fixture
+def trepo(tmp_path):
+    trepo = TableRepo(tmp_path / "recs")
+    trepo.extend(pd.DataFrame({"id": [3, 1, 2], "x": ["c", "a", "b"]}))
+    return trepo
+
+
+def test_compacted_table_stays_compact_after_a_write(trepo):
+    assert compact_paths(trepo.paths, ["id"])["rewritten"] == 1
+    assert compact_paths(trepo.paths, ["id"])["rewritten"] == 0
+    # parquetranger rewrites the file, with its own codec
+    trepo.extend(pd.DataFrame({"id": [4], "x": ["d"]}))
+    assert compact_paths(trepo.paths, ["id"])["rewritten"] == 0
+    assert trepo.get_full_df()["id"].tolist() == [1, 2, 3, 4]
+
+
+def test_compaction_waits_for_writers(trepo):
+    path = next(iter(trepo.paths))
+    lock = acquire_lock(path)
+    thread = threading.Thread(target=compact_paths, args=(trepo.paths, ["id"]))
+    thread.start()
+    thread.join(0.5)
+    assert thread.is_alive()
+    lock.release()
+    thread.join()
+    assert trepo.get_full_df()["id"].tolist() == [1, 2, 3]
+
+
+def test_compaction_refuses_to_run_under_collect(tmp_path, monkeypatch):
+    monkeypatch.setattr(compaction, "COLLECT_LOCK_PATH", tmp_path / "collect.lock")
+    with collect_lock(), collect_lock():
+        with pytest.raises(CollectRunning):
+            with collect_lock(exclusive=True):
+                pass
+    with collect_lock(exclusive=True):
+        pass
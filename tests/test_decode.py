@@ -0,0 +1,57 @@
+import random
+
+import datazimmer as dz
+import pandas as pd
+import pytest
+
+from src.bench import ad_payloads, baseline_ad_tables, get_pcevs
+from src.decode import decode_ad_batch, get_dim_key
+from src.meta import Location, Price, RealEstate, Seller
+from src.parse import extract_listing_payloads
+
+
+@pytest.fixture(scope="module")
+def payloads():
+    out = [extract_listing_payloads(p.content) for p in get_pcevs("ad_decode", 200)]
+    # ads collected twice in the batch
+    return out + out[:20]
+
+
+def _assert_tables_equal(new: dict, old: dict):
+    assert new.keys() == old.keys()
+    for entity, df in new.items():
+        cols = dz.EntityClass.from_cls(entity).table_feature_cols
+        pd.testing.assert_frame_equal(
+            df.reindex(cols, axis=1), old[entity].reindex(cols, axis=1)
+        )
+
+
+def test_decoder_matches_table_parsers(payloads):
+    old = baseline_ad_tables(payloads)
+    # the table parsers keep a seller row per ad, the decoder one per seller
+    old[Seller] = old[Seller].loc[lambda df: ~df.index.duplicated()]
+    _assert_tables_equal(decode_ad_batch(payloads), old)
+
+
+def test_decoder_skips_stored_dims(payloads):
+    old = baseline_ad_tables(payloads)
+    sellers, locations = old[Seller].index, old[Location].index
+    skip_dims = [get_dim_key(Seller, {"id": i}) for i in sellers[::2]] + [
+        get_dim_key(Location, {"id": i}) for i in locations[::3]
+    ]
+    old[Seller] = old[Seller].loc[lambda df: ~df.index.duplicated()].drop(sellers[::2])
+    old[Location] = old[Location].drop(locations[::3])
+    _assert_tables_equal(decode_ad_batch(payloads, skip_dims), old)
+
+
+def test_bad_child_field_is_quarantined_whole():
+    listing, hierarchy = ad_payloads(1, random.Random(0))
+    listing["prices"] = [
+        {"amount": 100_000, "currency": "HUF", "interval": {"m": 1}},
+        {"amount": 300, "currency": "EUR", "interval": "monthly"},
+    ]
+    drift = []
+    dfs = decode_ad_batch([(listing, hierarchy)], drift=drift)
+    assert Price not in dfs
+    assert len(dfs[RealEstate]) == 1
+    assert [rec[:2] for rec in drift] == [("Price", "prices")]
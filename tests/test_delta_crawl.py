@@ -0,0 +1,51 @@
+from unittest import mock
+
+import pytest
+
+from src import ingatlan
+from src.bench import get_pcevs
+from src.ingatlan import AdHandler, ListingHandler
+from src.parse import get_ad_id
+from src.stores import SqliteKV
+
+
+@pytest.fixture
+def indexes(tmp_path):
+    seen = SqliteKV(tmp_path / "listing-seen.sqlite", "listing_cards")
+    pending = SqliteKV(tmp_path / "listing-seen.sqlite", "pending_cards")
+    with mock.patch.object(
+        ingatlan, "get_listing_seen_index", return_value=seen
+    ), mock.patch.object(ingatlan, "get_listing_pending_index", return_value=pending):
+        yield seen, pending
+
+
+def _crawl_listing(blob) -> dict:
+    handler = ListingHandler()
+    handler.parse(blob)
+    return {
+        get_ad_id(e.url.split("/")[-1]): e.overwrite for e in handler._registered_links
+    }
+
+
+def _fetch_ad(ad_id):
+    handler = AdHandler()
+    handler.set_url(f"{AdHandler.url_root}/{ad_id}")
+    handler.parse(b"")
+
+
+def test_unfetched_ads_stay_due(indexes):
+    seen, pending = indexes
+    blob = get_pcevs("listing_new", 1)[0].content
+    first = _crawl_listing(blob)
+    # ads fetched before are reset to be fetched again
+    assert first and all(first.values())
+    assert len(seen) == 0
+
+    # nothing fetched yet, so the same cards are due again
+    assert _crawl_listing(blob) == first
+
+    fetched = sorted(first)[:3]
+    for ad_id in fetched:
+        _fetch_ad(ad_id)
+    assert sorted(seen.get_many(first)) == fetched
+    assert set(_crawl_listing(blob)) == set(first) - set(fetched)
@@ -0,0 +1,108 @@
+import json
+import re
+import socket
+from collections import Counter
+
+import aswan
+import pytest
+from aswan.constants import WE_SOURCE_K, Statuses
+
+from src.dispatch import ReplayClient, UrlDispatcher, pages_from_depot
+
+ROOT = "https://example.hu"
+INIT_URL = f"{ROOT}/lista"
+CAPTCHA_URL = f"{ROOT}/lista?page=captcha"
+PAGE_URLS = [f"{ROOT}/lista?page={i}" for i in range(2, 22)]
+
+
+class PageHandler(aswan.WebExtHandler):
+    process_indefinitely = False
+
+    def parse(self, we_resp: bytes):
+        source = json.loads(we_resp)[WE_SOURCE_K]
+        if "robot-protection" in source:
+            raise aswan.ConnectionError("captcha")
+        self.register_links_to_handler(re.findall(r'href="([^"]+)"', source))
+        return source
+
+
+class CountingDispatcher(UrlDispatcher):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.url_leases = Counter()
+
+    def lease(self, worker):
+        url = super().lease(worker)
+        if url is not None:
+            self.url_leases[url] += 1
+        return url
+
+
+@pytest.fixture
+def project(tmp_path):
+    project = aswan.Project("dispatch-test", local_root=tmp_path)
+    project.register_handler(PageHandler)
+    return project
+
+
+@pytest.fixture
+def port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _pages() -> dict:
+    links = "".join(f'<a href="{url}">x</a>' for url in [*PAGE_URLS, CAPTCHA_URL])
+    return {
+        INIT_URL: f"<html><body>{links}</body></html>",
+        CAPTCHA_URL: "<html><body>robot-protection</body></html>",
+        **{url: f"<html><body>{url}</body></html>" for url in PAGE_URLS},
+    }
+
+
+def _run(project, port, pages, drop_rate=0, **kwargs) -> tuple:
+    dispatcher = CountingDispatcher(
+        project, [PageHandler], port=port, write_every=5, **kwargs
+    )
+    client = ReplayClient(pages, workers=4, drop_rate=drop_rate, port=port).start()
+    try:
+        dispatcher.run(urls_to_register={PageHandler: [INIT_URL]}, new_run=True)
+    finally:
+        client.stop()
+    return dispatcher, client
+
+
+def _statuses(project) -> dict:
+    return {
+        pcev.url: pcev.cev.status
+        for pcev in project.depot.get_handler_events(
+            PageHandler, only_successful=False, from_current=True
+        )
+    }
+
+
+def test_every_url_processed_and_captcha_given_up(project, port):
+    dispatcher, _ = _run(project, port, _pages(), max_attempts=3)
+    statuses = _statuses(project)
+    assert {statuses[url] for url in [INIT_URL, *PAGE_URLS]} == {Statuses.PROCESSED}
+    assert statuses[CAPTCHA_URL] == Statuses.CONNECTION_ERROR
+    assert dispatcher.url_leases[CAPTCHA_URL] == 3
+    assert dispatcher.counter["gave_up"] == 1
+    assert dispatcher.counter["processed"] == len(PAGE_URLS) + 1
+
+
+def test_dropped_leases_are_leased_again(project, port):
+    _run(project, port, _pages())
+    stored = pages_from_depot(project, PageHandler, from_current=True)
+    assert set(stored) == {INIT_URL, *PAGE_URLS}
+
+    dispatcher, client = _run(
+        project, port, stored, drop_rate=0.3, lease_timeout=0.5, max_attempts=20
+    )
+    statuses = _statuses(project)
+    assert {statuses[url] for url in [INIT_URL, *PAGE_URLS]} == {Statuses.PROCESSED}
+    assert client.counter["dropped"] > 0
+    assert dispatcher.counter["expired"] >= client.counter["dropped"]
+    assert dispatcher.counter["processed"] == len(PAGE_URLS) + 1
+    assert any(dispatcher.url_leases[url] > 1 for url in PAGE_URLS)
@@ -0,0 +1,61 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+from src.drift import iter_drift_recs, quarantine_drift
+from src.ingatlan import TABLE_MAPPING
+from src.meta import Price, RealEstate
+
+
+def _price_df() -> pd.DataFrame:
+    return pd.DataFrame(
+        {
+            "amount": [100_000, "megegyezés szerint", 250.5, 300_000],
+            "interval_m": [1.0, 1.0, "havonta", np.nan],
+            "vat": [None, None, None, "27%"],
+        },
+        index=pd.MultiIndex.from_tuples(
+            [(1, "HUF"), (2, "HUF"), (3, "EUR"), (4, "HUF")],
+            names=["property_id__id", "currency"],
+        ),
+    )
+
+
+def test_drifted_int_values_quarantined_with_their_records():
+    drift = []
+    df = quarantine_drift(_price_df(), TABLE_MAPPING[Price], drift)
+    assert df.index.get_level_values(0).tolist() == [1, 4]
+    assert df["amount"].astype(int).tolist() == [100_000, 300_000]
+    assert [(rec[1], json.loads(rec[3])) for rec in drift] == [
+        ("vat", "27%"),
+        ("amount", "megegyezés szerint"),
+        ("amount", 250.5),
+        ("interval_m", "havonta"),
+    ]
+
+
+def test_nested_str_values_quarantined():
+    df = pd.DataFrame(
+        {
+            "description": ["szép", {"hu": "szép"}, ["a", "b"]],
+            "cluster_id": [1, 2, 3],
+            "location_id__id": [1, 1, 1],
+            "seller_id__id": [1, 1, 1],
+        },
+        index=pd.Index([10, 11, 12], name="id"),
+    )
+    drift = []
+    out = quarantine_drift(df, TABLE_MAPPING[RealEstate], drift)
+    assert out["description"].tolist()[0] == "szép"
+    assert out["description"].iloc[1:].isna().all()
+    assert [(rec[1], json.loads(rec[2])) for rec in drift] == [
+        ("description", 11),
+        ("description", 12),
+    ]
+
+
+def test_duplicate_keys_all_kept():
+    s = pd.Series(["a", "b", None], index=[1, 1, 2])
+    recs = list(iter_drift_recs("RealEstate", "x", s))
+    assert [json.loads(rec[3]) for rec in recs] == ["a", "b"]
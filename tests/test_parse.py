@@ -0,0 +1,73 @@
+import json
+from collections import Counter
+from unittest import mock
+
+import pandas as pd
+import pytest
+from bs4 import BeautifulSoup
+
+from src import parse
+from src.bench import baseline_ad_tables, get_pcevs
+from src.parse import LISTING_ATTS, expand_dicts, expand_rows, extract_listing_payloads
+
+ATT_VALUES = [
+    "/x?a=1&region=2&not=3",
+    "&amp;&amp-x &copy &copy2 &notit &notin; &#65&#x42; &nosuchref;",
+    "&lt&gt= &ltx &lt;a&gt; &AMP &amp;=",
+]
+
+
+def _listing_page(value: str, quote: str = '"') -> str:
+    payload = json.dumps({"url": value}).replace('"', "&quot;")
+    return (
+        f"<html><body><div class=x id={quote}listing{quote} "
+        f"data-listing={quote}{payload}{quote} "
+        f"data-location-hierarchy={quote}[]{quote}></div></body></html>"
+    )
+
+
+@pytest.mark.parametrize("value", ATT_VALUES)
+@pytest.mark.parametrize("quote", ['"', "'"])
+def test_listing_payloads_match_html5lib(value, quote):
+    page = _listing_page(value, quote)
+    counter = Counter()
+    fast = extract_listing_payloads(page, counter)
+    elem = BeautifulSoup(page, "html5lib").select_one("#listing")
+    assert counter["fast_path"] == 1
+    assert fast == tuple(json.loads(elem.get(k)) for k in LISTING_ATTS)
+    assert fast[0]["url"] == json.loads(elem.get("data-listing"))["url"]
+
+
+def test_bare_refs_kept_in_urls():
+    listing, _ = extract_listing_payloads(_listing_page("/x?a=1&region=2&not=3"))
+    assert listing["url"] == "/x?a=1&region=2&not=3"
+
+
+@pytest.fixture(scope="module")
+def ad_payloads():
+    return [extract_listing_payloads(p.content) for p in get_pcevs("ad_tables", 200)]
+
+
+def test_expand_dicts_matches_row_wise(ad_payloads):
+    new = baseline_ad_tables(ad_payloads)
+    with mock.patch.object(parse, "expand_dicts", expand_rows):
+        old = baseline_ad_tables(ad_payloads)
+    assert new.keys() == old.keys()
+    for entity, df in new.items():
+        # row-wise, a parking without a price made a stray 0 column
+        pd.testing.assert_frame_equal(
+            df, old[entity].drop(columns=0, errors="ignore"), check_column_type=False
+        )
+
+
+@pytest.mark.parametrize(
+    "values",
+    [
+        [{"a": 1}, None, {"b": "x", "a": 2}],
+        [{"m": 1}, {}, {"y": None, "m": 1, "d": None}],
+        [{"a": 1}, "not a dict", None],
+    ],
+)
+def test_expand_dicts_edge_cases(values):
+    s = pd.Series(values, index=[10, 20, 30], dtype=object)
+    pd.testing.assert_frame_equal(expand_dicts(s), expand_rows(s))
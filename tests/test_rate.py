@@ -0,0 +1,155 @@
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import aswan
+import pytest
+from aswan.connection_session import ConnectionSession, HandlingTask
+from aswan.constants import Statuses
+
+from src import rate
+from src.rate import (
+    AimdRateController,
+    RateControlledMixin,
+    RateController,
+    read_rate_metrics,
+)
+
+
+class FakeServer(ThreadingHTTPServer):
+    """answers with the queued status codes, 200 once they run out"""
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _StatusHandler)
+        self.statuses = deque()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}/"
+
+
+class _StatusHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        status = self.server.statuses.popleft() if self.server.statuses else 200
+        self.send_response(status)
+        self.end_headers()
+        self.wfile.write(b"ok" if status == 200 else b"slow down")
+
+    def log_message(self, *args):
+        pass
+
+
+class PacedHandler(RateControlledMixin, aswan.RequestHandler):
+    rate_controller_kwargs = {"initial_delay": 2, "backoff_base": 5}
+
+
+class RecordingSession(ConnectionSession):
+    """the session aswan runs the handlers in, keeping the statuses"""
+
+    def __init__(self, depot_path):
+        super().__init__(depot_path=depot_path)
+        self.statuses = []
+
+    def proc_result(self, task, out, status):
+        self.statuses.append(status)
+        return super().proc_result(task, out, status)
+
+
+@pytest.fixture
+def server():
+    server = FakeServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    thread.join()
+
+
+@pytest.fixture
+def sleep():
+    rate._CONTROLLERS.clear()
+    with mock.patch("time.sleep") as sleep:
+        yield sleep
+    rate._CONTROLLERS.clear()
+
+
+@pytest.fixture
+def session(tmp_path, sleep):
+    session = RecordingSession(tmp_path / "rate-test")
+    yield session
+    session.stop()
+
+
+def _consume(session, server, n: int, statuses=()):
+    server.statuses.extend(statuses)
+    for _ in range(n):
+        session.consume(HandlingTask(PacedHandler(), server.url))
+    return session.statuses[-n:]
+
+
+def test_aimd_backs_off_and_recovers(server, session, sleep):
+    controller = PacedHandler().rate_controller
+    assert _consume(session, server, 10) == [Statuses.PROCESSED] * 10
+    fast_delay = 1 / controller.rate
+    assert fast_delay < 2
+
+    # aswan restarts the broken session, so the handler backs off
+    # before each request after the first throttled one
+    throttled = _consume(session, server, 3, [429, 503, 429])
+    assert throttled == [Statuses.SESSION_BROKEN] * 3
+    assert controller.failures == 3
+    assert 1 / controller.rate == pytest.approx(fast_delay * 8)
+    assert controller.metrics["throttled"] == 3
+    assert controller.metrics["backoffs"] == 2
+
+    assert _consume(session, server, 10) == [Statuses.PROCESSED] * 10
+    assert controller.failures == 0
+    assert 1 / controller.rate < fast_delay * 8
+    assert controller.metrics["requests"] == 23
+    assert controller.metrics["successes"] == 20
+    assert controller.metrics["backoffs"] == 3
+    assert controller.metrics["status_429"] == 2
+    assert controller.metrics["status_503"] == 1
+    # every wait went through time.sleep in the aswan session
+    waited = sum(c.args[0] for c in sleep.call_args_list)
+    assert waited == pytest.approx(
+        controller.metrics["pacing_seconds"] + controller.metrics["backoff_seconds"]
+    )
+    # exponential from backoff_base, jittered by half
+    assert controller.metrics["backoff_seconds"] >= 5 + 10 + 20
+
+
+def test_metrics_of_crawl_processes_merged(server, session, tmp_path):
+    metrics_dir = tmp_path / "rate-metrics"
+    with mock.patch.object(
+        PacedHandler, "get_rate_metrics_dir", return_value=metrics_dir
+    ):
+        for statuses in [[429], [503, 429]]:
+            # as if in a new crawl process
+            rate._PROCESS.clear()
+            _consume(session, server, 5, statuses)
+    assert len(list(metrics_dir.glob("*.json"))) == 2
+
+    merged = read_rate_metrics(metrics_dir)[PacedHandler().name]
+    assert merged["requests"] == 10
+    assert merged["successes"] == 7
+    assert merged["throttled"] == 3
+    assert merged["status_429"] == 2
+    assert merged["mean_latency"] == pytest.approx(merged["latency_sum"] / 7)
+    assert read_rate_metrics(metrics_dir) == {}
+
+
+def test_rate_controller_is_abstract():
+    with pytest.raises(TypeError):
+        RateController("x")
+
+    class Fixed(RateController):
+        def get_delay(self):
+            return 1
+
+        def get_backoff(self):
+            return 10
+
+    assert Fixed("x").get_delay() == 1
+    assert isinstance(AimdRateController("x"), RateController)
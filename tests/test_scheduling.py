@@ -0,0 +1,44 @@
+import pytest
+
+from src.scheduling import AdaptiveScheduler, CollectBudget, run_measured
+
+MB = 10**6
+
+
+def _allocating(batch: list) -> int:
+    # a megabyte per event, written so it is resident
+    blob = b"x" * (len(batch) * MB)
+    return len(blob) // MB
+
+
+@pytest.fixture
+def budget():
+    return CollectBudget(
+        memory_gb=1,
+        max_workers=2,
+        initial_batch_size=5,
+        min_batch_size=2,
+        max_batch_size=40,
+        batches_per_round=2,
+    )
+
+
+def test_batches_resized_in_one_pool(budget):
+    scheduler = AdaptiveScheduler(budget)
+    assert scheduler.batch_size == 5
+    outs = list(scheduler.map(_allocating, range(400)))
+    assert sum(outs) == 400
+    sizes = [s.size for s in scheduler.stats]
+    assert sizes[0] == 5
+    assert max(sizes) == 40
+    # one pool for all the batches
+    assert len({s.worker for s in scheduler.stats}) <= 2
+
+
+def test_batch_rss_measured_per_batch():
+    _, big = run_measured(_allocating, [0] * 200)
+    _, small = run_measured(_allocating, [0] * 10)
+    assert big.rss_per_event == pytest.approx(MB, rel=0.3)
+    # not the lifetime peak left by the big batch
+    assert small.peak_rss < big.peak_rss
+    assert small.rss_per_event == pytest.approx(MB, rel=0.5)
@@ -0,0 +1,99 @@
+import json
+import re
+from collections import Counter
+
+import pandas as pd
+import pytest
+from bs4 import BeautifulSoup
+
+from src.bench import FakePcev, get_pcevs
+from src.ingatlan_webext import search_results_from_pcev
+
+ATT_ROOT_CLASS = "d-flex flex-column justify-content-between h-100"
+LOC_SPAN = re.compile(
+    r'<span class="d-block fw-500 fs-7 text-onyx font-family-secondary">(.*?)</span>'
+)
+
+
+def baseline_search_results(pcev):
+    """the BeautifulSoup reader the xpaths replaced, without its debug prints"""
+    soup = BeautifulSoup(pcev.content, "lxml")
+    try:
+        page_n = int(pcev.url.split("=")[-1])
+    except ValueError:
+        page_n = 1
+    for ablock in soup.find_all("a", class_="listing-card"):
+        subd = json.loads(
+            ablock.get("data-listings-page--results-listing-listing-value", "{}")
+        )
+        att_dic = {}
+        att_root = ablock.find(class_=ATT_ROOT_CLASS)
+        if att_root is not None:
+            for d in att_root.find("div", class_="justify-content-start").find_all(
+                "div", class_="d-flex"
+            ):
+                k, v = (s.text for s in d.find_all("span"))
+                att_dic[k] = v
+        loc_elem = None
+        for class_ in [
+            "d-block fw-500 fs-7 text-onyx font-family-secondary",
+            "d-block fs-7 text-gray-900",
+        ]:
+            loc_elem = ablock.find("span", class_=class_)
+            if loc_elem is not None:
+                break
+        try:
+            loc = loc_elem.text
+        except AttributeError:
+            loc = ""
+        yield (
+            {
+                "page_no": page_n,
+                "price": getattr(
+                    ablock.find(string=re.compile(r".*\s+Ft/hó.*")), "text", ""
+                ),
+                "loc": loc,
+            }
+            | att_dic
+            | subd.pop("seller", {})
+            | subd
+            | {"data_id": ablock.get("data-listing-id")}
+            | {"collected": pd.to_datetime(pcev.cev.timestamp, unit="s").isoformat()}
+        )
+
+
+def _vary(pcev: FakePcev, i: int) -> FakePcev:
+    content = pcev.content
+    if i % 4 == 1:
+        # every other card without its att root
+        parts = content.split(ATT_ROOT_CLASS)
+        content = (
+            "".join(
+                p + (ATT_ROOT_CLASS if j % 2 else "d-flex flex-column")
+                for j, p in enumerate(parts[:-1])
+            )
+            + parts[-1]
+        )
+    elif i % 4 == 2:
+        content = LOC_SPAN.sub("", content, count=7)
+    elif i % 4 == 3:
+        content = LOC_SPAN.sub(
+            r'<span class="d-block fs-7 text-gray-900">\1</span>', content
+        )
+        content = content.encode("utf-8")
+    return FakePcev(content, pcev.url, pcev.timestamp)
+
+
+@pytest.fixture(scope="module")
+def pcevs():
+    return [_vary(pcev, i) for i, pcev in enumerate(get_pcevs("webext_search", 80))]
+
+
+def test_xpath_cards_match_baseline(pcevs):
+    counter = Counter()
+    for pcev in pcevs:
+        new = list(search_results_from_pcev(pcev, counter))
+        assert new == list(baseline_search_results(pcev))
+    assert counter["cards"] == 80 * 20
+    assert counter["missing_att_root"] == 20 * 10
+    assert counter["missing_loc"] == 20 * 7
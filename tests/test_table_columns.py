@@ -0,0 +1,66 @@
+import datazimmer as dz
+import pandas as pd
+import pytest
+from datazimmer.metadata.atoms import parse_df
+from parquetranger import TableRepo
+
+from src.bench import get_pcevs
+from src.compaction import add_missing_columns, get_entity_schema, get_missing_columns
+from src.meta import RealEstateRecord
+from src.parse import parse_listings
+
+NEW_COLS = [
+    RealEstateRecord.price_huf,
+    RealEstateRecord.price_unit,
+    RealEstateRecord.area_sqm,
+    RealEstateRecord.balcony_sqm,
+    RealEstateRecord.full_rooms,
+    RealEstateRecord.half_rooms,
+    RealEstateRecord.photos,
+]
+
+
+@pytest.fixture(scope="module")
+def records():
+    df = parse_listings(get_pcevs("listing_new", 10))
+    return parse_df(df, RealEstateRecord)
+
+
+@pytest.fixture
+def old_trepo(tmp_path, records):
+    trepo = TableRepo(tmp_path / "real_estate_record")
+    trepo.extend(records.drop(columns=NEW_COLS).iloc[:50])
+    return trepo
+
+
+def _schema():
+    dtype_map = dz.EntityClass.from_cls(RealEstateRecord).table_full_dt_map
+    return get_entity_schema(dtype_map)
+
+
+def test_new_columns_dropped_without_migration(old_trepo, records):
+    old_trepo.extend(records.iloc[50:])
+    assert not set(NEW_COLS) & set(old_trepo.get_full_df().columns)
+
+
+def test_new_columns_land_after_migration(old_trepo, records):
+    paths = list(old_trepo.paths)
+    assert get_missing_columns(paths, _schema())
+    counter = add_missing_columns(paths, _schema())
+    assert counter["columns_added"] == len(NEW_COLS)
+    assert not get_missing_columns(paths, _schema())
+
+    old_trepo.extend(records.iloc[50:])
+    df = old_trepo.get_full_df()
+    assert df.shape[0] == records.shape[0]
+    new = df.loc[records.index[50:], NEW_COLS]
+    pd.testing.assert_frame_equal(
+        new.astype(object), records.iloc[50:][NEW_COLS].astype(object)
+    )
+    assert df.loc[records.index[:50], NEW_COLS].isna().all().all()
+
+
+def test_migration_is_idempotent(old_trepo):
+    paths = list(old_trepo.paths)
+    add_missing_columns(paths, _schema())
+    assert not add_missing_columns(paths, _schema())
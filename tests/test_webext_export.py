@@ -0,0 +1,87 @@
+import json
+import time
+from collections import Counter
+from unittest import mock
+
+import pandas as pd
+from parquetranger import TableRepo
+
+from src import ingatlan_webext
+from src.bench import get_pcevs
+from src.ingatlan_webext import (
+    SEARCH_TEXT_COLS,
+    clean_search_df,
+    cols,
+    get_search_page,
+    migrate_old_search_results,
+)
+from src.stores import SqliteKV, hash_content
+
+
+def _search_chunk(n: int, n_locs: int, city) -> pd.DataFrame:
+    return pd.DataFrame(
+        {c: [None] * n for c in cols}
+        | {
+            "id": range(n),
+            "collected": ["2024-01-02T10:00:00"] * n,
+            "loc": [f"Hely {i % n_locs}" for i in range(n)],
+            "city": [city] * n,
+            "vendor_url": [f"https://v{i % 300}.hu" for i in range(n)],
+            "price": ["150 000 Ft/hó"] * n,
+        }
+    )
+
+
+def test_text_cols_survive_later_extends(tmp_path):
+    trepo = TableRepo(tmp_path / "search", group_cols="collection_week")
+    trepo.extend(_search_chunk(20, 5, None).pipe(clean_search_df))
+    trepo.extend(_search_chunk(860, 860, "Budapest").pipe(clean_search_df))
+    df = trepo.get_full_df()
+    assert df.shape[0] == 880
+    assert df["loc"].notna().all()
+    assert df["vendor_url"].notna().all()
+    assert df["city"].notna().sum() == 860
+    assert set(df["loc"]) == {f"Hely {i}" for i in range(860)}
+    for c in SEARCH_TEXT_COLS:
+        assert not isinstance(df[c].dtype, pd.CategoricalDtype)
+
+
+def test_old_search_results_migrated_once(tmp_path):
+    old_root = tmp_path / "search-results-v2"
+    # as the string typed export wrote them
+    old = _search_chunk(30, 7, "Budapest").assign(
+        szobak="2 + 1 fél", collection_week="2024-01-01"
+    )
+    TableRepo(old_root, group_cols="collection_week").extend(
+        old.drop(columns="felszobak")
+    )
+    trepo = TableRepo(tmp_path / "search-results-v3", group_cols="collection_week")
+    with mock.patch.object(
+        ingatlan_webext, "OLD_SEARCH_ROOT", old_root
+    ), mock.patch.object(ingatlan_webext, "search_trepo", trepo):
+        assert migrate_old_search_results() == 30
+        assert migrate_old_search_results() == 0
+    df = trepo.get_full_df()
+    assert df.shape[0] == 30
+    assert (df["price"] == 150_000).all()
+    assert (df["felszobak"] == 1).all()
+    assert not old_root.exists()
+    assert list((tmp_path / "search-results-v2.migrated").rglob("*.parquet"))
+
+
+def test_search_page_index_pruned_after_export(tmp_path):
+    old, new = get_pcevs("webext_search", 2)
+    index = SqliteKV(tmp_path / "index.sqlite", "search_pages")
+    with mock.patch.object(
+        ingatlan_webext, "get_search_page_index", return_value=index
+    ):
+        pages = [get_search_page(pcev) for pcev in (old, new)]
+        index.set_many({hash_content(old.content): json.dumps(pages[0])})
+        started = time.time()
+        index.set_many({hash_content(new.content): json.dumps(pages[1])})
+        assert index.prune(started) == 1
+        assert len(index) == 1
+
+        counter = Counter()
+        assert [get_search_page(pcev, counter) for pcev in (old, new)] == pages
+    assert counter["parsed_pages"] == counter["indexed_pages"] == 1